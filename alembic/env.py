@@ -9,7 +9,7 @@ import sideboard
 import darecms
 from sideboard.lib.sa import CoerceUTF8, UTCDateTime, UUID
 from darecms.migration import version_locations_option
-from darecms.models import Choice, MultiChoice, Session
+from darecms.models import Choice, MultiChoice, Session, TSVector
 
 
 # This is the alembic Config object, which provides access to "alembic.ini".
@@ -44,6 +44,9 @@ def render_item(type_, obj, autogen_context):
             return 'sideboard.lib.sa.UTCDateTime()'
         elif isinstance(obj, (CoerceUTF8, MultiChoice)):
             return 'sa.Unicode()'
+        elif isinstance(obj, TSVector):
+            autogen_context.imports.add('from sqlalchemy.dialects import postgresql')
+            return 'postgresql.TSVECTOR()'
         elif isinstance(obj, UUID):
             autogen_context.imports.add('import sideboard.lib.sa')
             return 'sideboard.lib.sa.UUID()'
@@ -0,0 +1,25 @@
+"""Add user watchlist guesses
+
+Revision ID: 2f8d4c7e1a36
+Revises: 9e03b6d1f8a2
+Create Date: 2026-10-19 14:02:57.904416
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2f8d4c7e1a36'
+down_revision = '9e03b6d1f8a2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # populated afterwards by running "sep screen_watchlist"
+    op.add_column('user', sa.Column('watchlist_guesses', sa.Unicode(), server_default='', nullable=False))
+
+
+def downgrade():
+    op.drop_column('user', 'watchlist_guesses')
@@ -0,0 +1,69 @@
+"""Add user search document
+
+Revision ID: 5c1e7a4b2d90
+Revises:
+Create Date: 2026-10-19 09:12:41.218375
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '5c1e7a4b2d90'
+down_revision = None
+branch_labels = ('darecms',)
+depends_on = None
+
+
+search_attrs = ['first_name', 'last_name', 'email', 'comments', 'admin_notes']
+trigram_attrs = ['first_name', 'last_name', 'email']
+
+
+def is_postgres():
+    return op.get_bind().dialect.name == 'postgresql'
+
+
+def upgrade():
+    op.add_column('user', sa.Column('search_text', sa.Unicode(), server_default='', nullable=False))
+    op.add_column('user', sa.Column('search_vector', postgresql.TSVECTOR() if is_postgres() else sa.Unicode(), nullable=True))
+    op.execute("UPDATE \"user\" SET search_text = lower(trim({}))".format(
+        " || ' ' || ".join("coalesce({}, '')".format(attr) for attr in search_attrs)))
+
+    if is_postgres():
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        op.execute("UPDATE \"user\" SET search_vector = to_tsvector('simple', search_text)")
+        op.execute('CREATE INDEX ix_user_search_vector ON "user" USING gin (search_vector)')
+        for attr in trigram_attrs:
+            op.execute('CREATE INDEX ix_user_{0}_trgm ON "user" USING gin ({0} gin_trgm_ops)'.format(attr))
+    else:
+        op.execute("CREATE VIRTUAL TABLE user_search USING fts5(search_text, content='user')")
+        op.execute(
+            'CREATE TRIGGER user_search_insert AFTER INSERT ON "user" BEGIN '
+            '  INSERT INTO user_search(rowid, search_text) VALUES (new.rowid, new.search_text); '
+            'END')
+        op.execute(
+            'CREATE TRIGGER user_search_delete AFTER DELETE ON "user" BEGIN '
+            "  INSERT INTO user_search(user_search, rowid, search_text) VALUES ('delete', old.rowid, old.search_text); "
+            'END')
+        op.execute(
+            'CREATE TRIGGER user_search_update AFTER UPDATE OF search_text ON "user" BEGIN '
+            "  INSERT INTO user_search(user_search, rowid, search_text) VALUES ('delete', old.rowid, old.search_text); "
+            '  INSERT INTO user_search(rowid, search_text) VALUES (new.rowid, new.search_text); '
+            'END')
+        op.execute("INSERT INTO user_search(user_search) VALUES ('rebuild')")
+
+
+def downgrade():
+    if is_postgres():
+        for attr in trigram_attrs:
+            op.execute('DROP INDEX IF EXISTS ix_user_{}_trgm'.format(attr))
+        op.execute('DROP INDEX IF EXISTS ix_user_search_vector')
+    else:
+        for trigger in ['insert', 'delete', 'update']:
+            op.execute('DROP TRIGGER IF EXISTS user_search_{}'.format(trigger))
+        op.execute('DROP TABLE IF EXISTS user_search')
+
+    op.drop_column('user', 'search_vector')
+    op.drop_column('user', 'search_text')
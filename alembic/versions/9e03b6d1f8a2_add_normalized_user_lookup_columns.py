@@ -0,0 +1,50 @@
+"""Add normalized user lookup columns
+
+Revision ID: 9e03b6d1f8a2
+Revises: 5c1e7a4b2d90
+Create Date: 2026-10-19 11:40:06.553102
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import re
+
+
+# revision identifiers, used by Alembic.
+revision = '9e03b6d1f8a2'
+down_revision = '5c1e7a4b2d90'
+branch_labels = None
+depends_on = None
+
+
+user_table = sa.table(
+    'user',
+    sa.Column('id', sa.Unicode()),
+    sa.Column('cellphone', sa.Unicode()),
+    sa.Column('cellphone_digits', sa.Unicode()),
+)
+
+
+def upgrade():
+    op.add_column('user', sa.Column('normalized_email', sa.Unicode(), server_default='', nullable=False))
+    op.add_column('user', sa.Column('cellphone_digits', sa.Unicode(), server_default='', nullable=False))
+
+    op.execute('UPDATE "user" SET normalized_email = lower(trim(email))')
+    connection = op.get_bind()
+    if connection.dialect.name == 'postgresql':
+        op.execute("UPDATE \"user\" SET cellphone_digits = regexp_replace(cellphone, '[^0-9]', '', 'g')")
+    else:
+        for id, cellphone in connection.execute(sa.select([user_table.c.id, user_table.c.cellphone])).fetchall():
+            connection.execute(user_table.update()
+                               .where(user_table.c.id == id)
+                               .values(cellphone_digits=re.sub(r'[^0-9]', '', cellphone or '')))
+
+    op.create_index('ix_user_normalized_email', 'user', ['normalized_email'])
+    op.create_index('ix_user_cellphone_digits', 'user', ['cellphone_digits'])
+
+
+def downgrade():
+    op.drop_index('ix_user_cellphone_digits', table_name='user')
+    op.drop_index('ix_user_normalized_email', table_name='user')
+    op.drop_column('user', 'cellphone_digits')
+    op.drop_column('user', 'normalized_email')
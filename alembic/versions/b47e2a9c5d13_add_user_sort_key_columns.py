@@ -0,0 +1,37 @@
+"""Add user sort key columns
+
+Revision ID: b47e2a9c5d13
+Revises: 2f8d4c7e1a36
+Create Date: 2026-10-19 15:27:33.671920
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b47e2a9c5d13'
+down_revision = '2f8d4c7e1a36'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('user', sa.Column('full_name_sort', sa.Unicode(), server_default='', nullable=False))
+    op.add_column('user', sa.Column('last_first_sort', sa.Unicode(), server_default='', nullable=False))
+    op.execute("""
+        UPDATE "user" SET
+            full_name_sort = CASE WHEN coalesce(first_name, '') = '' THEN 'zzz'
+                                  ELSE lower(first_name || ' ' || last_name) END,
+            last_first_sort = CASE WHEN coalesce(first_name, '') = '' THEN 'zzz'
+                                   ELSE lower(last_name || ', ' || first_name) END
+    """)
+    op.create_index('ix_user_full_name_sort', 'user', ['full_name_sort'])
+    op.create_index('ix_user_last_first_sort', 'user', ['last_first_sort'])
+
+
+def downgrade():
+    op.drop_index('ix_user_last_first_sort', table_name='user')
+    op.drop_index('ix_user_full_name_sort', table_name='user')
+    op.drop_column('user', 'last_first_sort')
+    op.drop_column('user', 'full_name_sort')
@@ -0,0 +1,55 @@
+"""Add email status and unique claim index
+
+Revision ID: d3a8f61c2e47
+Revises: b47e2a9c5d13
+Create Date: 2026-10-19 17:04:12.508213
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd3a8f61c2e47'
+down_revision = 'b47e2a9c5d13'
+branch_labels = None
+depends_on = None
+
+
+# The value of c.EMAIL_SENT, which every email we've already recorded has.
+email_sent = 111654981
+
+
+def upgrade():
+    op.add_column('email', sa.Column('status', sa.Integer(), server_default=str(email_sent), nullable=False))
+    op.add_column('email', sa.Column('automated', sa.Boolean(), server_default='false', nullable=False))
+
+    # Every email the daemon has already sent (i.e. with the ident of one of
+    # the categories registered by our plugins) counts as claimed, so that it's
+    # never sent again.  We may have sent the same automated email to someone
+    # more than once in the past; rather than changing those records, we only
+    # flag the earliest of each, which keeps the new unique index satisfied.
+    from darecms.automated_emails_server import AutomatedEmail
+    idents = list(AutomatedEmail.instances)
+    if idents:
+        op.get_bind().execute(sa.text("""
+            UPDATE email SET automated = true
+            WHERE id IN (
+                SELECT id FROM (
+                    SELECT id, row_number() OVER (PARTITION BY model, fk_id, ident ORDER BY "when", id) AS n
+                    FROM email WHERE fk_id IS NOT NULL AND ident IN :idents
+                ) numbered
+                WHERE n = 1
+            )
+        """).bindparams(sa.bindparam('idents', expanding=True)), idents=idents)
+
+    op.create_index('ix_email_model_fk_id_ident', 'email', ['model', 'fk_id', 'ident'])
+    op.create_index('ix_email_automated_claim', 'email', ['model', 'fk_id', 'ident'], unique=True,
+                    postgresql_where=sa.text('automated'), sqlite_where=sa.text('automated'))
+
+
+def downgrade():
+    op.drop_index('ix_email_automated_claim', table_name='email')
+    op.drop_index('ix_email_model_fk_id_ident', table_name='email')
+    op.drop_column('email', 'automated')
+    op.drop_column('email', 'status')
@@ -18,16 +18,66 @@ config_fields = [
 
 
 class ConfigLookup:
-    def info(self):
-        output = {
-            'API_VERSION': __version__
-        }
-        for field in config_fields:
-            output[field] = getattr(c, field)
-        return output
+    """
+    Exposes a handful of our config values to other services.  Since these
+    only change when our config is reloaded or one of our deadlines passes,
+    we build the payload once and cache it along with a version hash of its
+    contents, and give each caller its own copy of it.  Clients which poll us
+    can pass back the last version they saw and will get a short "not
+    modified" reply if nothing has changed, e.g.
+
+        info = config.info()
+        ...
+        latest = config.info(version=info['VERSION'])
+        if not latest.get('NOT_MODIFIED'):
+            info = latest
+    """
+
+    def __init__(self):
+        self.lock = RLock()
+        self.payload = None
+
+    def invalidate(self):
+        with self.lock:
+            self.payload = None
+
+    def _payload(self):
+        with self.lock:
+            if self.payload is None:
+                output = {
+                    'API_VERSION': __version__
+                }
+                for field in config_fields:
+                    output[field] = getattr(c, field, None)  # not every event defines all of these, e.g. EVENT_VENUE
+                serialized = json.dumps(output, cls=serializer, sort_keys=True)
+                output = json.loads(serialized)
+                output['VERSION'] = sha512(serialized.encode('utf-8')).hexdigest()[:16]
+                self.payload = output
+            return self.payload
+
+    def _not_modified(self, version):
+        return {'VERSION': version, 'NOT_MODIFIED': True}
+
+    def info(self, version=None):
+        payload = self._payload()
+        return self._not_modified(version) if version == payload['VERSION'] else deepcopy(payload)
 
     def lookup(self, field):
         if field.upper() in config_fields:
-            return getattr(c, field.upper())
+            return deepcopy(self._payload()[field.upper()])
+
+    def lookup_many(self, fields, version=None):
+        """Returns a dict of the requested config fields (ignoring any we don't expose) in a single call."""
+        payload = self._payload()
+        if version == payload['VERSION']:
+            return self._not_modified(version)
+
+        output = {field.upper(): deepcopy(payload[field.upper()]) for field in fields if field.upper() in config_fields}
+        output['VERSION'] = payload['VERSION']
+        return output
+
+config_lookup = ConfigLookup()
+deadlines.on_flip(config_lookup.invalidate)
+on_config_reload(config_lookup.invalidate)
 
-services.register(ConfigLookup(), 'config')
+services.register(config_lookup, 'config')
@@ -0,0 +1,186 @@
+from darecms.common import *
+
+
+class AssetManifest:
+    """
+    Maps each of our static files (e.g. "css/custom.css") to a fingerprinted
+    name containing a hash of its contents (e.g. "css/custom.1b2c3d4e5f60.css")
+    so that browsers can cache them forever; whenever a file changes, so does
+    its URL.  Use the asset_url() template function to link to these files.
+
+    Plugins can override our static files by calling static_overrides() with
+    their own static directory; for each file, the most recently added
+    directory which contains it wins.
+
+    Lists of files which are always included together can also be
+    concatenated into a single file; see the [asset_bundles] config section.
+
+    The manifest is written to disk by "sep build_assets" and loaded by each
+    server process on first use, or rebuilt if any of the files it lists have
+    been modified since it was written.
+    """
+
+    def __init__(self):
+        self.lock = RLock()
+        self.static_dirs = []
+        self.manifest = None
+
+    @property
+    def output_dir(self):
+        if c.ASSET_DIR:
+            return c.ASSET_DIR
+        from sideboard.lib import config as sideboard_config
+        return join(sideboard_config['root'], 'data', 'assets')
+
+    @property
+    def manifest_path(self):
+        return join(self.output_dir, 'manifest.json')
+
+    def add_static_dir(self, dirname):
+        with self.lock:
+            self.static_dirs.append(os.path.abspath(dirname).rstrip('/'))
+            self.manifest = None
+
+    def source_files(self):
+        """Returns a dict mapping each static file's path (relative to its static directory) to its full filename."""
+        files = {}
+        for basedir in self.static_dirs:
+            for dpath, dirs, fnames in os.walk(basedir):
+                for fname in fnames:
+                    files[os.path.relpath(join(dpath, fname), basedir)] = join(dpath, fname)
+        return files
+
+    @staticmethod
+    def fingerprinted(path, contents):
+        base, ext = os.path.splitext(path)
+        return '{}.{}{}'.format(base, sha512(contents).hexdigest()[:12], ext)
+
+    @staticmethod
+    def bundle_path(name, members):
+        return '{}/{}.bundle{}'.format(os.path.dirname(members[0]), name, os.path.splitext(members[0])[1])
+
+    def build(self):
+        """
+        Hashes every static file, writes out any configured bundles, and saves
+        the resulting manifest to disk.  Returns the new manifest.
+        """
+        sources = self.source_files()
+        manifest = {'files': {}, 'bundles': {}, 'mtimes': {}, 'bundle_config': c.ASSET_BUNDLES.dict()}
+        for path, filename in sources.items():
+            manifest['files'][path] = {'url': self.fingerprinted(path, self._read(filename)), 'filename': filename}
+            manifest['mtimes'][filename] = os.stat(filename).st_mtime
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        for name, members in c.ASSET_BUNDLES.items():
+            missing = [path for path in members if path not in sources]
+            if missing:
+                log.warning('skipping asset bundle {} because these files are missing: {}', name, missing)
+                continue
+
+            separator = b';\n' if members[0].endswith('.js') else b'\n'
+            contents = separator.join(self._read(sources[path]) for path in members)
+            path = self.bundle_path(name, members)
+            filename = join(self.output_dir, self.fingerprinted(path, contents).replace('/', '_'))
+            with open(filename, 'wb') as f:
+                f.write(contents)
+            manifest['files'][path] = {'url': self.fingerprinted(path, contents), 'filename': filename}
+            manifest['bundles'][name] = path
+
+        with open(self.manifest_path, 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+
+        with self.lock:
+            self.manifest = self._with_routes(manifest)
+        return self.manifest
+
+    @staticmethod
+    def _read(filename):
+        with open(filename, 'rb') as f:
+            return f.read()
+
+    def _with_routes(self, manifest):
+        manifest['routes'] = {entry['url']: entry['filename'] for entry in manifest['files'].values()}
+        return manifest
+
+    def _is_current(self, manifest):
+        try:
+            sources = self.source_files()
+            return manifest.get('bundle_config') == c.ASSET_BUNDLES.dict() \
+               and set(sources.values()) == set(manifest['mtimes']) \
+               and all(os.stat(filename).st_mtime == mtime for filename, mtime in manifest['mtimes'].items()) \
+               and all(os.path.exists(entry['filename']) for entry in manifest['files'].values())
+        except OSError:
+            return False
+
+    def get_manifest(self):
+        with self.lock:
+            if self.manifest is None:
+                try:
+                    with open(self.manifest_path) as f:
+                        manifest = json.load(f)
+                except (OSError, ValueError):
+                    manifest = None
+
+                if manifest and self._is_current(manifest):
+                    self.manifest = self._with_routes(manifest)
+                else:
+                    self.build()
+            return self.manifest
+
+    def url(self, path):
+        entry = self.get_manifest()['files'].get(path)
+        return '{}/static/{}'.format(c.PATH, entry['url'] if entry else path)
+
+    def bundle_urls(self, name):
+        manifest = self.get_manifest()
+        if c.BUNDLE_ASSETS and name in manifest['bundles']:
+            return [self.url(manifest['bundles'][name])]
+        else:
+            return [self.url(path) for path in c.ASSET_BUNDLES.get(name, [])]
+
+    def filename(self, path):
+        """
+        Returns the filename to serve for a request to /static/<path>, and whether
+        the path was fingerprinted (and is thus safe to cache forever).
+        """
+        manifest = self.get_manifest()
+        if path in manifest['routes']:
+            return manifest['routes'][path], True
+        elif path in manifest['files']:
+            return manifest['files'][path]['filename'], False
+        else:
+            return None, False
+
+asset_manifest = AssetManifest()
+
+
+@JinjaEnv.jinja_export
+def asset_url(path):
+    """Returns the fingerprinted URL of one of our static files, e.g. {{ asset_url('css/custom.css') }}"""
+    return asset_manifest.url(path)
+
+
+@JinjaEnv.jinja_export
+def asset_bundle_urls(name):
+    """
+    Returns the URLs to include for one of the bundles in our [asset_bundles] config, which is either the single
+    concatenated bundle (if c.BUNDLE_ASSETS is set) or each of its files.
+    """
+    return asset_manifest.bundle_urls(name)
+
+
+class StaticFiles:
+    """
+    Serves /static/... paths out of our asset manifest.  Fingerprinted URLs
+    never change contents, so we tell browsers to cache those for a year.
+    """
+
+    @cherrypy.expose
+    def default(self, *path_args, **kwargs):
+        filename, fingerprinted = asset_manifest.filename('/'.join(path_args))
+        if not filename:
+            raise cherrypy.NotFound()
+
+        if fingerprinted:
+            cherrypy.response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+        return cherrypy.lib.static.serve_file(filename)
@@ -0,0 +1,126 @@
+from tempfile import NamedTemporaryFile
+
+from darecms.common import *
+
+
+class EmailDaemonRun:
+    """
+    Metrics for one run of the automated email daemon.  For each email
+    category we record how many candidates were loaded from the database, how
+    many emails were sent, how many candidates were skipped and why (e.g.
+    failing the category's filter, or the category not being approved), and
+    how long we spent selecting, rendering, and sending.  We also record how
+    many emails were waiting in our outbox when the run started and finished.
+    """
+
+    def __init__(self):
+        self.started = datetime.now(UTC)
+        self.started_at = perf_counter()
+        self.seconds = None
+        self.queue_depth = {'start': sa.outbox.queue.qsize(), 'end': None}
+        self.categories = OrderedDict()
+
+    def category(self, ident):
+        if ident not in self.categories:
+            self.categories[ident] = {
+                'closed': None,  # why this category couldn't send anything this run, if it couldn't
+                'candidates': 0,
+                'sent': 0,
+                'skipped': defaultdict(int),
+                'seconds': defaultdict(float)
+            }
+        return self.categories[ident]
+
+    def skip(self, ident, reason, count=1):
+        self.category(ident)['skipped'][reason] += count
+
+    def add_time(self, ident, stage, seconds):
+        self.category(ident)['seconds'][stage] += seconds
+
+    def finish(self):
+        self.seconds = perf_counter() - self.started_at
+        self.queue_depth['end'] = sa.outbox.queue.qsize()
+        email_daemon_runs.record(self)
+
+    def to_dict(self):
+        return {
+            'started': self.started.isoformat(),
+            'seconds': self.seconds,
+            'queue_depth': self.queue_depth,
+            'sent': sum(category['sent'] for category in self.categories.values()),
+            'categories': OrderedDict((ident, {
+                'closed': category['closed'],
+                'candidates': category['candidates'],
+                'sent': category['sent'],
+                'skipped': dict(category['skipped']),
+                'seconds': dict(category['seconds'])
+            }) for ident, category in self.categories.items())
+        }
+
+
+class EmailDaemonRuns:
+    """
+    Ring buffer of the metrics from our most recent email daemon runs, newest
+    first.  Each run is logged as a line of JSON and the buffer is saved to
+    disk, so that "sep email_daemon_runs" can show it from another process.
+    """
+
+    def __init__(self):
+        self.lock = RLock()
+        self.runs = deque(maxlen=c.EMAIL_DAEMON_RUN_HISTORY)
+
+    @property
+    def filename(self):
+        from sideboard.lib import config as sideboard_config
+        return join(sideboard_config['root'], 'data', 'email_daemon_runs.json')
+
+    def record(self, run):
+        metrics = run.to_dict()
+        log.info('email daemon run: {}', json.dumps(metrics, sort_keys=True))
+        with self.lock:
+            self.runs.appendleft(metrics)
+            try:
+                self._save(list(self.runs))
+            except OSError:
+                log.warning('unable to save email daemon metrics to {}', self.filename, exc_info=True)
+
+    def _save(self, runs):
+        """
+        Writes our runs to a temporary file alongside our real one and then
+        renames it into place, so other processes never read a partial file.
+        """
+        os.makedirs(dirname(self.filename), exist_ok=True)
+        with NamedTemporaryFile('w', dir=dirname(self.filename), suffix='.tmp', delete=False) as f:
+            json.dump(runs, f, indent=2)
+        try:
+            os.replace(f.name, self.filename)
+        except OSError:
+            os.remove(f.name)
+            raise
+
+    def recent(self):
+        """Returns the metrics of our recent runs, reading them from disk if this process hasn't done any runs."""
+        with self.lock:
+            if self.runs:
+                return list(self.runs)
+        try:
+            with open(self.filename) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return []
+
+    @staticmethod
+    def category_totals(runs):
+        """Adds up each category's metrics across the given runs, slowest categories first."""
+        totals = defaultdict(lambda: {'candidates': 0, 'sent': 0, 'skipped': defaultdict(int), 'seconds': defaultdict(float)})
+        for run in runs:
+            for ident, category in run['categories'].items():
+                totals[ident]['candidates'] += category['candidates']
+                totals[ident]['sent'] += category['sent']
+                for reason, count in category['skipped'].items():
+                    totals[ident]['skipped'][reason] += count
+                for stage, seconds in category['seconds'].items():
+                    totals[ident]['seconds'][stage] += seconds
+        return sorted(totals.items(), key=lambda item: sum(item[1]['seconds'].values()), reverse=True)
+
+email_daemon_runs = EmailDaemonRuns()
@@ -1,4 +1,8 @@
-from uber.common import *
+import pickle
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from darecms.common import *
 
 
 class AutomatedEmail:
@@ -17,11 +21,23 @@ class AutomatedEmail:
             subqueryload(User.admin_account)),
     }
 
-    def __init__(self, model, subject, template, filter, ident, *, when=(),
+    def __init__(self, model, subject, template, filter, ident, *, when=(), sql_filter=None,
                  sender=None, extra_data=None, cc=None, bcc=None,
                  post_con=False, needs_approval=True, allow_during_con=False):
+        """
+        The filter is a function which takes a model instance and returns whether we should send this email to
+        it.  Categories may also pass a sql_filter, which is a function returning a SQLAlchemy clause (or a list of
+        them) that narrows down which rows the email daemon loads before running the Python filter, e.g.
+
+            sql_filter=lambda: User.verified == True
 
-        self.subject = subject.format(EVENT_NAME=c.EVENT_NAME, EVENT_DATE=c.EPOCH.strftime("(%b %Y)"))
+        The sql_filter should match every row the Python filter would, and is called once per daemon run, so it
+        can refer to config values which change over time.  Categories whose conditions can be written entirely as
+        a sql_filter can pass None as their filter, which lets us count their recipients exactly in SQL; see
+        SendAllAutomatedEmailsJob.dry_run().
+        """
+
+        self.subject = subject.format(EVENT_NAME=c.EVENT_NAME, EVENT_DATE=c.EPOCH.strftime("(%b %Y)") if c.EPOCH else '')
         self.ident = ident
 
         assert self.ident, 'error: automated email ident may not be empty.'
@@ -35,9 +51,13 @@ class AutomatedEmail:
         self.extra_data = extra_data or {}
         self.sender = sender or c.REGDESK_EMAIL
         self.when = listify(when)
+        self.sql_filter = sql_filter
+        self.post_con = bool(post_con)
 
-        assert filter is not None
+        assert filter is not None or sql_filter is not None, 'error: automated email needs a filter or sql_filter'
 
+        self.python_filter = filter
+        filter = filter or (lambda model_inst: True)
         if post_con:
             self.filter = lambda model_inst: c.POST_CON and filter(model_inst)
         else:
@@ -49,6 +69,46 @@ class AutomatedEmail:
     def _run_date_filters(self):
         return all([date_filter() for date_filter in self.when])
 
+    def gates_open(self):
+        """
+        Returns whether this category could send any emails right now, based only on the things which are the same
+        for every model instance: whether we're at or after the event, and our date filters.  The email daemon
+        checks this once per category per run instead of once per model instance.
+        """
+        return not self.closed_reason()
+
+    def closed_reason(self):
+        """Returns why gates_open() is False, or None if it's True."""
+        if c.AT_THE_CON and not self.allow_during_con:
+            return 'at the con'
+        elif bool(c.POST_CON) != self.post_con:
+            return 'after the con' if c.POST_CON else 'before the con'
+        elif not self._run_date_filters():
+            return 'date filters'
+
+    @property
+    def is_approved(self):
+        """Like approved, but without recording anything in the currently running email daemon's stats."""
+        return not self.needs_approval or self.ident in c.EMAIL_APPROVED_IDENTS
+
+    def candidates(self, session):
+        """
+        Returns a query of the model instances which might need this email, i.e. rows of our model which match our
+        sql_filter, have an email address, and haven't already been sent this email.  Our Python filter still needs
+        to be run against each of these.
+        """
+        query_fn = AutomatedEmail.queries.get(self.model)
+        if not query_fn:
+            return []
+
+        already_sent = session.query(Email.id).filter(
+            Email.model == self.model.__name__, Email.fk_id == self.model.id, Email.ident == self.ident,
+            ~Email.claimable)
+        query = query_fn(session).filter(self.model.email != None, self.model.email != '', ~already_sent.exists())
+        if self.sql_filter:
+            query = query.filter(*listify(self.sql_filter()))
+        return query
+
     def __repr__(self):
         return '<{}: {!r}>'.format(self.__class__.__name__, self.subject)
 
@@ -61,60 +121,6 @@ class AutomatedEmail:
         """
         return self.subject
 
-    def _already_sent(self, model_inst):
-        """
-        Returns true if we have a record of previously sending this email to this model
-
-        NOTE: c.PREVIOUSLY_SENT_EMAILS is a cached property and will only update at the start of each daemon run.
-        """
-        return (model_inst.__class__.__name__, model_inst.id, self.ident) in c.PREVIOUSLY_SENT_EMAILS
-
-    def send_if_should(self, model_inst, raise_errors=False):
-        """
-        If it's OK to send an email of our category to this model instance (i.e. a particular User) then send it.
-        """
-        try:
-            if self._should_send(model_inst):
-                self.really_send(model_inst)
-        except:
-            log.error('error sending {!r} email to {}', self.subject, model_inst.email, exc_info=True)
-            if raise_errors:
-                raise
-
-    def _should_send(self, model_inst):
-        """
-        If True, we should generate an actual email created from our email category
-        and send it to a particular model instance.
-
-        This is determined based on a few things like:
-        1) whether we have sent this exact email out yet or not
-        2) whether the email category has been approved
-        3) whether the model instance passed in is the same type as what we want to process
-        4) do any date-based filters exist on this email category? (i.e. send 7 days before magfest)
-        5) do any other filters exist on this email category? (i.e. only if attendee.staffing == true)
-
-        Example #1 of a model instance to check:
-          self.ident: "You {attendee.name} have registered for our event!"
-          model_inst:  class Attendee: id #4532, name: "John smith"
-
-        Example #2 of a model instance to check:
-          self.ident: "Your group {group.name} owes money"
-          model_inst:  class Group: id #1251, name: "The Fighting Mongooses"
-
-        :param model_inst: The model we've been requested to use (i.e. Attendee, Group, etc)
-
-        :return: True if we should send this email to this model instance, False if not.
-        """
-
-        return all(condition() for condition in [
-            lambda: not c.AT_THE_CON or self.allow_during_con,
-            lambda: isinstance(model_inst, self.model),
-            lambda: getattr(model_inst, 'email', None),
-            lambda: not self._already_sent(model_inst),
-            lambda: self.filters_run(model_inst),
-            lambda: self.approved,
-        ])
-
     @property
     def approved(self):
         """
@@ -126,7 +132,7 @@ class AutomatedEmail:
         emails that would have been sent so we can report it via the UI later.
         """
 
-        approved_to_send = not self.needs_approval or self.ident in c.EMAIL_APPROVED_IDENTS
+        approved_to_send = self.is_approved
 
         if not approved_to_send:
             # log statistics about how many emails would have been sent if we had approval.
@@ -135,27 +141,37 @@ class AutomatedEmail:
 
         return approved_to_send
 
+    @property
+    def model_name(self):
+        """The name our templates use for the model instance we're emailing, e.g. "user"."""
+        return getattr(self.model, 'email_model_name', self.model.__name__.lower())
+
     def render(self, model_instance):
         model = getattr(model_instance, 'email_model_name', model_instance.__class__.__name__.lower())
         return render('emails/' + self.template, dict({model: model_instance}, **self.extra_data))
 
-    def really_send(self, model_instance):
+    def send_claimed(self, session, model_instance, body=None):
         """
-        Actually send an email to a particular model instance (i.e. a particular attendee).
+        Renders this email for a particular model instance (unless it's already been rendered and passed as body),
+        claims it in the database with Session.claim_email(), and only then queues it to be sent.  If another
+        process (or an earlier run) has already claimed this email for this model instance, we don't send it.
+        Returns whether we queued the email.
 
-        Doesn't perform any kind of checks at all if we should be sending this, just immediately sends the email
-        no matter what.
-
-        NOTE: use send_if_should() instead of calling this method unless you 100% know what you're doing.
-        NOTE: send_email() fails if c.SEND_EMAILS is False
+        The subject is formatted here, since it's saved with the claim; send_email() doesn't format it again.
         """
         try:
-            subject = self.computed_subject(model_instance)
-            format = 'text' if self.template.endswith('.txt') else 'html'
-            send_email(self.sender, model_instance.email, subject,
-                       self.render(model_instance), format,
-                       model=model_instance, cc=self.cc, ident=self.ident)
+            subject = self.computed_subject(model_instance).format(c=c)
+            body = self.render(model_instance) if body is None else body
+            body = body.decode('utf-8') if isinstance(body, bytes) else body
+            claim_id = session.claim_email(model_instance, self.ident, subject=subject, dest=model_instance.email, body=body)
+            session.commit()
+            if claim_id:
+                format = 'text' if self.template.endswith('.txt') else 'html'
+                send_email(self.sender, model_instance.email, subject, body, format,
+                           model=model_instance, cc=self.cc, bcc=self.bcc, ident=self.ident, claimed=claim_id)
+            return bool(claim_id)
         except:
+            session.rollback()
             log.error('error sending {!r} email to {}', self.subject, model_instance.email, exc_info=True)
             raise
 
@@ -168,6 +184,150 @@ class AutomatedEmail:
         return '\n'.join([filter.active_when for filter in self.when])
 
 
+class RecipientSnapshot:
+    """
+    Plain-data copy of a model instance which we send to our render worker
+    processes instead of the ORM object itself.  It holds the values of every
+    column plus the properties named in the model's _email_snapshot_attrs.
+
+    Templates which use anything else (e.g. a relationship) can't be rendered
+    correctly from a snapshot, so we record every missing attribute a template
+    asks for; the daemon renders those emails itself from the real object.
+    """
+
+    def __init__(self, model_instance):
+        self.__dict__.update({col.name: getattr(model_instance, col.name) for col in model_instance.__table__.columns})
+        self.__dict__.update({attr: getattr(model_instance, attr)
+                              for attr in getattr(model_instance, '_email_snapshot_attrs', [])})
+        self._missing = set()
+
+    def __getattr__(self, name):
+        if not name.startswith('__'):
+            self.__dict__.setdefault('_missing', set()).add(name)
+        raise AttributeError(name)
+
+
+def _warm_render_worker(templates):
+    """
+    Runs once in each render worker process, compiling the templates it'll be
+    rendering.  Workers never touch the database, so we also throw away any
+    connections the worker's copy of our engine might be holding.
+    """
+    Session.engine.dispose()
+    env = JinjaEnv.env()
+    for template in templates:
+        env.get_template('emails/' + template)
+
+
+def _render_snapshots(template, model_name, extra_data, snapshots):
+    """
+    Renders one batch of emails in a render worker process, returning a list
+    with an entry for each snapshot: either its rendered body, or else None
+    along with the attributes the snapshot was missing (if that's why).
+    """
+    results = []
+    for snapshot in snapshots:
+        try:
+            body = render('emails/' + template, dict({model_name: snapshot}, **extra_data))
+        except Exception:
+            results.append((None, sorted(snapshot._missing)))
+        else:
+            results.append((None, sorted(snapshot._missing)) if snapshot._missing else (body, []))
+    return results
+
+
+class EmailRenderer:
+    """
+    Renders automated emails for the email daemon on a pool of worker
+    processes, since rendering is CPU-bound and otherwise dominates each run.
+    Recipients are split into batches of c.EMAIL_RENDER_BATCH_SIZE and sent
+    to the workers as RecipientSnapshots, and the rendered batches are given
+    back in the same order as the recipients.  A few batches are kept in
+    flight at once, so we can be sending one batch while others are rendered.
+
+    Workers are started at the start of each daemon run by a forkserver
+    process which has already imported darecms, rather than being forked from
+    our threaded server, and are warmed up by compiling every email template;
+    they never touch the database.  Any email which can't be rendered from a
+    snapshot is given back with a body of None, and gets rendered on the
+    daemon's thread by AutomatedEmail.send_claimed().
+    """
+
+    def __init__(self, processes=None, batch_size=None):
+        self.processes = c.EMAIL_RENDER_PROCESSES if processes is None else processes
+        self.batch_size = batch_size or c.EMAIL_RENDER_BATCH_SIZE
+        self.pool = None
+        self.warned = set()
+
+    def __enter__(self):
+        if self.processes:
+            templates = {category.template for category in AutomatedEmail.instances.values()}
+            context = multiprocessing.get_context('forkserver')
+            context.set_forkserver_preload(['darecms.common'])
+            self.pool = ProcessPoolExecutor(self.processes, mp_context=context,
+                                            initializer=_warm_render_worker, initargs=(templates,))
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.pool:
+            self.pool.shutdown()
+            self.pool = None
+
+    def _batches(self, model_instances):
+        batch = []
+        for model_instance in model_instances:
+            batch.append(model_instance)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _can_render_remotely(self, email_category):
+        try:
+            pickle.dumps(email_category.extra_data)
+        except Exception:
+            return False
+        else:
+            return self.pool is not None
+
+    def render_batches(self, email_category, model_instances):
+        """
+        Yields a list of (model instance, rendered body) pairs for each batch
+        of the given model instances, in order.
+        """
+        if not self._can_render_remotely(email_category):
+            for batch in self._batches(model_instances):
+                yield [(model_instance, None) for model_instance in batch]
+            return
+
+        pending = deque()
+        for batch in self._batches(model_instances):
+            snapshots = [RecipientSnapshot(model_instance) for model_instance in batch]
+            pending.append((batch, self.pool.submit(_render_snapshots, email_category.template,
+                                                    email_category.model_name, email_category.extra_data, snapshots)))
+            if len(pending) > 2 * self.processes:
+                yield self._rendered(email_category, *pending.popleft())
+
+        while pending:
+            yield self._rendered(email_category, *pending.popleft())
+
+    def _rendered(self, email_category, batch, future):
+        try:
+            results = future.result()
+        except Exception:
+            log.error('error rendering a batch of {!r} emails, rendering them locally instead',
+                      email_category.subject, exc_info=True)
+            results = [(None, [])] * len(batch)
+
+        for body, missing in results:
+            if missing and email_category.ident not in self.warned:
+                self.warned.add(email_category.ident)
+                log.warning('{!r} emails use {} which are not in {}._email_snapshot_attrs, so they are being rendered '
+                            'on the email daemon thread', email_category.ident, missing, email_category.model.__name__)
+        return [(model_instance, body) for model_instance, (body, missing) in zip(batch, results)]
+
+
 class SendAllAutomatedEmailsJob:
 
     # save information about the last time the daemon ran so that we can display stats on things like
@@ -181,7 +341,6 @@ class SendAllAutomatedEmailsJob:
         """ Helper method to start a run of our automated email processing """
         cls().run(raise_errors)
 
-    @timed
     def run(self, raise_errors=False):
         """
         Do one run of our automated email service.  Call this periodically to send any emails that should go out
@@ -204,10 +363,12 @@ class SendAllAutomatedEmailsJob:
             SendAllAutomatedEmailsJob.run_lock.release()
 
     def _run(self, raise_errors):
-        with Session() as session:
+        with Session() as session, EmailRenderer() as renderer:
             # performance: we use request_cached_context() to force cache invalidation
             # of variables like c.EMAIL_APPROVED_IDENTS
             with request_cached_context(clear_cache_on_start=True):
+                self.renderer = renderer
+                self.metrics = EmailDaemonRun()
                 self._init(session, raise_errors)
                 self._send_all_emails()
                 self._on_finished_run()
@@ -226,6 +387,8 @@ class SendAllAutomatedEmailsJob:
         threadlocal.set('currently_running_email_daemon', self)
 
     def _on_finished_run(self):
+        outbox.flush_statuses()
+        self.metrics.finish()
         self.results['running'] = False
         self.results['completed'] = True
 
@@ -236,37 +399,161 @@ class SendAllAutomatedEmailsJob:
         This function is the heart of the automated email daemon in ubersystem
         and is called once every couple of minutes.
 
-        To send automated emails, we look at AutomatedEmail.queries for a list of DB queries to run.
-        The result of these queries are a list of model instances that we might want to send emails for.
-
-        These model instances will be of type 'MagModel'. Examples: 'Attendee', 'Group'.
-        Each model instance is, for example, a particular group, or a particular attendee.
+        We go through *ALL* AutomatedEmail's that are registered in the system.  (When you see AutomatedEmail
+        think "email category").  For each one, we first check the things which don't depend on who we're
+        emailing: whether the time is right (e.g. we're before a deadline) and whether admins have approved the
+        category.  If it can't send anything right now, we move on without querying anything.
 
-        Next, we'll go through *ALL* AutomatedEmail's that are registered in the system.
-        (When you see AutomatedEmail think "email category").  On each of these we'll ask that
-        email category if it wants to send any emails for this particular model (i.e. a specific attendee).
+        Otherwise we ask the database for the candidates for that category: the rows of its model (i.e. a
+        specific user) which match its sql_filter, have an email address, and have no Email row recording that
+        they've already been sent this email.  Only those candidates are loaded and run through the category's
+        Python filter, and each one which passes gets sent the email.  If the category hasn't been approved, we
+        instead count how many emails it would have sent so we can report that to the admins.
 
-        If that automated email decides the time is right (i.e. it hasn't sent the email already, the attendee has a
-        valid email address, email has been approved for sending, and a bunch of other stuff), then it will actually
-        send an email for this model instance.
+        Emails are rendered in batches by our EmailRenderer's worker processes, and each rendered batch is
+        claimed and queued using its own short-lived session, so that committing claims never expires the
+        candidates we're still working through in our main session.
         """
-        for model, query_fn in AutomatedEmail.queries.items():
-            model_instances = query_fn(self.session)
-            for model_instance in model_instances:
-                sleep(0.01)  # throttle CPU usage
-                self._send_any_emails_for(model_instance)
+        for email_category in AutomatedEmail.instances.values():
+            closed_reason = email_category.closed_reason()
+            if closed_reason:
+                self.metrics.category(email_category.ident)['closed'] = closed_reason
+            else:
+                self._send_category(email_category)
+
+    def _send_category(self, email_category):
+        ident, metrics = email_category.ident, self.metrics
+        recipients = self._recipients(email_category)
+        if not email_category.is_approved:
+            for model_instance in recipients:
+                metrics.skip(ident, 'not approved')
+                self._increment_unsent_because_unapproved_count(email_category)
+            return
 
-    def _send_any_emails_for(self, model_instance):
-        """
-        Go through every email category in the system and ask it if it wants to send any email on behalf of this
-        particular model instance.
+        # the renderer pulls recipients as it goes, so we subtract the time spent selecting them from the render time
+        batches = self.renderer.render_batches(email_category, recipients)
+        while True:
+            started, selecting = perf_counter(), metrics.category(ident)['seconds']['select']
+            batch = next(batches, None)
+            metrics.add_time(ident, 'render', perf_counter() - started - (metrics.category(ident)['seconds']['select'] - selecting))
+            if batch is None:
+                break
+
+            with Session() as claim_session:
+                for model_instance, body in batch:
+                    self._send_one(email_category, claim_session, model_instance, body)
+
+    def _send_one(self, email_category, claim_session, model_instance, body):
+        ident = email_category.ident
+        try:
+            if body is None:
+                started = perf_counter()
+                try:
+                    body = email_category.render(model_instance)
+                except:
+                    log.error('error rendering {!r} email to {}', email_category.subject, model_instance.email, exc_info=True)
+                    raise
+                finally:
+                    self.metrics.add_time(ident, 'render', perf_counter() - started)
+
+            started = perf_counter()
+            try:
+                if email_category.send_claimed(claim_session, model_instance, body):
+                    self.metrics.category(ident)['sent'] += 1
+                else:
+                    self.metrics.skip(ident, 'already claimed')
+            finally:
+                self.metrics.add_time(ident, 'send', perf_counter() - started)
+        except:
+            self.metrics.skip(ident, 'error')
+            if self.raise_errors:
+                raise
 
-        An example of a model + category combo to check:
-          email_category: "You {attendee.name} have registered for our event!"
-          model_instance:  Attendee #42
+    def _recipients(self, email_category):
+        """Yields the candidates for this email category which pass its Python filter."""
+        ident = email_category.ident
+        started = perf_counter()
+        for model_instance in email_category.candidates(self.session):
+            self.metrics.category(ident)['candidates'] += 1
+            try:
+                if email_category.filter(model_instance):
+                    self.metrics.add_time(ident, 'select', perf_counter() - started)
+                    yield model_instance
+                    started = perf_counter()
+                else:
+                    self.metrics.skip(ident, 'filter')
+            except:
+                log.error('error checking whether to send {!r} email to {}',
+                          email_category.subject, model_instance.email, exc_info=True)
+                self.metrics.skip(ident, 'filter error')
+                if self.raise_errors:
+                    raise
+        self.metrics.add_time(ident, 'select', perf_counter() - started)
+
+    @classmethod
+    def dry_run(cls, idents=None, sample_size=None):
         """
-        for email_category in AutomatedEmail.instances.values():
-            email_category.send_if_should(model_instance, self.raise_errors)
+        Works out how many emails each category (or just the ones with the given idents) would send if it were
+        approved and open right now, without rendering or sending anything, so that admins can see the volume of
+        a category before approving it.  Returns an OrderedDict mapping each ident to a dict of:
+
+            closed: why the category can't send anything right now (e.g. "date filters"), or None
+            approved: whether the category has been approved
+            candidates: how many rows match the category's sql_filter and haven't already been sent this email
+            estimated: how many emails we estimate the category would send
+            exact: whether that estimate is an exact count
+            sampled: how many candidates we ran the Python filter against
+            sample: a few of the recipients, as (id, email) pairs
+
+        Categories with no Python filter are counted entirely in SQL.  Otherwise, if there are no more than
+        sample_size candidates we run the filter against all of them, and if there are more then we run it against
+        a random sample of that size and extrapolate from how many of those pass.
+        """
+        sample_size = sample_size or c.EMAIL_ESTIMATE_SAMPLE_SIZE
+        estimates = OrderedDict()
+        with Session() as session, request_cached_context(clear_cache_on_start=True):
+            for email_category in AutomatedEmail.instances.values():
+                if idents and email_category.ident not in idents:
+                    continue
+
+                query = email_category.candidates(session)
+                candidates = query.count() if query else 0
+                estimate = estimates[email_category.ident] = {
+                    'closed': email_category.closed_reason(),
+                    'approved': email_category.is_approved,
+                    'candidates': candidates,
+                    'estimated': candidates,
+                    'exact': True,
+                    'sampled': 0,
+                    'sample': []
+                }
+                if not candidates:
+                    continue
+
+                if not email_category.python_filter:
+                    recipients = query.limit(c.EMAIL_ESTIMATE_RECIPIENTS).all()
+                else:
+                    if candidates > sample_size:
+                        query = query.order_by(None).order_by(func.random()).limit(sample_size)
+                    sampled = query.all()
+                    recipients = [model_instance for model_instance in sampled if cls._passes(email_category, model_instance)]
+                    estimate.update({
+                        'sampled': len(sampled),
+                        'exact': candidates <= sample_size,
+                        'estimated': round(len(recipients) * candidates / len(sampled)) if sampled else 0
+                    })
+
+                estimate['sample'] = [(model_instance.id, model_instance.email)
+                                      for model_instance in recipients[:c.EMAIL_ESTIMATE_RECIPIENTS]]
+        return estimates
+
+    @staticmethod
+    def _passes(email_category, model_instance):
+        try:
+            return email_category.python_filter(model_instance)
+        except:
+            log.error('error checking whether to send {!r} email to {}', email_category.subject, model_instance.email, exc_info=True)
+            return False
 
     @classmethod
     def _currently_running_daemon_on_this_thread(cls):
@@ -307,6 +594,11 @@ def notify_admins_of_any_pending_emails():
     send_email(c.STAFF_EMAIL, c.STAFF_EMAIL, subject, body, format='html', model='n/a')
 
 
+# development boxes can run the daemon by hand with SendAllAutomatedEmailsJob.send_all_emails(), but we don't want
+# them claiming (and thus marking as sent) every approved email in the background without actually sending them
+if c.SEND_EMAILS:
+    DaemonTask(SendAllAutomatedEmailsJob.send_all_emails, interval=c.EMAIL_DAEMON_INTERVAL, name="send emails")
+
 # 86400 seconds = 1 day = 24 hours * 60 minutes * 60 seconds
 DaemonTask(notify_admins_of_any_pending_emails, interval=86400, name="mail pending notification")
 
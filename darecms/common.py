@@ -19,9 +19,11 @@ import warnings
 import importlib
 import mimetypes
 import threading
+import signal
 import traceback
 from fuzzywuzzy import fuzz, process as fuzzyprocess
 from glob import glob
+from bisect import insort
 from uuid import uuid4
 from pprint import pprint
 from copy import deepcopy
@@ -31,15 +33,15 @@ from functools import wraps
 from xml.dom import minidom
 from random import randrange
 # from Crypto.Cipher import AES
-from contextlib import closing
-from time import sleep, mktime
+from contextlib import closing, ExitStack
+from time import sleep, mktime, perf_counter
 from io import StringIO, BytesIO
 from itertools import chain, count
-from collections import defaultdict, OrderedDict
+from collections import defaultdict, OrderedDict, deque
 from urllib.parse import quote, urlparse, quote_plus, parse_qsl, urljoin, urlencode
 from datetime import date, time, datetime, timedelta
 from threading import Thread, RLock, local, current_thread
-from types import FunctionType
+from types import FunctionType, MappingProxyType
 from os.path import abspath, basename, dirname, exists, join
 import requests
 import shutil
@@ -53,7 +55,7 @@ from markupsafe import text_type, Markup
 from pytz import UTC
 
 import sqlalchemy
-from sqlalchemy.sql import case
+from sqlalchemy.sql import case, literal_column
 from sqlalchemy.event import listen
 from sqlalchemy.ext import declarative
 from sqlalchemy import func, or_, and_, not_
@@ -62,7 +64,8 @@ from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.ext.hybrid import hybrid_property, hybrid_method
 from sqlalchemy.sql.expression import FunctionElement
 from sqlalchemy.orm.attributes import get_history, instance_state
-from sqlalchemy.schema import Column, ForeignKey, UniqueConstraint
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import Column, ForeignKey, UniqueConstraint, DDL
 from sqlalchemy.orm import Query, relationship, joinedload, subqueryload, backref
 from sqlalchemy.types import Boolean, Integer, Float, TypeDecorator, Date, Numeric
 
@@ -71,13 +74,19 @@ from sideboard.lib.sa import declarative_base, SessionManager, UTCDateTime, UUID
 
 import darecms
 import darecms as sa  # used to avoid circular dependency import issues for SQLAlchemy models
-from darecms.config import c, Config, SecretConfig
+from darecms.config import c, Config, SecretConfig, deadlines, reload_config, on_config_reload
 from darecms.utils import *
 from darecms.jinja import *
 from darecms.decorators import *
 from darecms.models import *
+from darecms.query_cache import *
+from darecms.counters import *
+from darecms.watchlist import *
 from darecms.automated_emails import *
+from darecms.outbox import *
+from darecms.automated_emails_server import *
 from darecms.menu import *
+from darecms.assets import *
 from darecms import custom_tags
 from darecms import model_checks
 from darecms import server
@@ -8,6 +8,7 @@ class _Overridable:
         for attr in dir(klass):
             if not attr.startswith('_'):
                 setattr(cls, attr, getattr(klass, attr))
+        _getters.clear()  # a new property may shadow a name we've already resolved
         return cls
 
     def include_plugin_config(self, plugin_config):
@@ -39,6 +40,9 @@ class _Overridable:
             setattr(self, _opt.upper(), _dt)
             if _dt:
                 self.DATES[_opt.upper()] = _dt
+            else:
+                self.DATES.pop(_opt.upper(), None)
+            deadlines.add_deadline(_opt.upper(), _dt)
 
     def make_enums(self, config_section):
         """
@@ -82,6 +86,95 @@ class _Overridable:
         return val
 
 
+class DeadlineTimeline:
+    """
+    Keeps a sorted timeline of every datetime we care about (all of the dates
+    in c.DATES, plus the dates used by the before/days_before/days_after
+    helpers in darecms.utils) and a cached "has this passed yet?" flag for each.
+
+    Rather than checking the clock every time someone reads c.BEFORE_FOO or
+    c.AFTER_FOO, we store those values as plain attributes on the global c
+    object and use a timer to flip them at the moment each deadline passes.
+
+    Unit tests can move the clock with deadlines.set_now(some_datetime) and put
+    it back with deadlines.set_now(None).
+    """
+
+    def __init__(self):
+        self.lock = RLock()
+        self.timeline = []      # sorted list of every datetime being watched
+        self.passed = {}        # datetime -> whether it is in the past
+        self.names = {}         # c.DATES name -> datetime, for the BEFORE_/AFTER_ flags
+        self.frozen_now = None
+        self.timer = None
+        self.listeners = []     # functions to call whenever a deadline passes
+
+    def now(self):
+        return self.frozen_now or datetime.now(UTC)
+
+    def watch(self, dt):
+        """Start tracking whether the given timezone-aware datetime has passed."""
+        with self.lock:
+            if dt not in self.passed:
+                insort(self.timeline, dt)
+                self.passed[dt] = self.now() > dt
+                self._schedule()
+
+    def has_passed(self, dt):
+        flag = self.passed.get(dt)
+        return self.now() > dt if flag is None else flag
+
+    def add_deadline(self, name, dt):
+        with self.lock:
+            self.names.pop(name, None)
+            if dt:
+                self.names[name] = dt
+                self.watch(dt)
+            self._set_flags(name, dt)
+
+    def on_flip(self, func):
+        """Registers a function to be called with no arguments whenever one of our deadlines passes."""
+        self.listeners.append(func)
+        return func
+
+    def set_now(self, now=None):
+        """Test hook: pretend that it's now the given datetime, or go back to the real clock if None."""
+        with self.lock:
+            self.frozen_now = now
+            self._flip()
+
+    def _set_flags(self, name, dt):
+        setattr(c, 'BEFORE_' + name, bool(dt) and not self.passed[dt])
+        setattr(c, 'AFTER_' + name, bool(dt) and self.passed[dt])
+
+    def _flip(self):
+        with self.lock:
+            now = self.now()
+            flipped = False
+            for dt in self.timeline:
+                flipped = flipped or self.passed[dt] != (now > dt)
+                self.passed[dt] = now > dt
+            for name, dt in self.names.items():
+                self._set_flags(name, dt)
+            self._schedule()
+
+        if flipped:
+            for func in self.listeners:
+                func()
+
+    def _schedule(self):
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+
+        upcoming = [dt for dt in self.timeline if not self.passed[dt]]
+        if upcoming and not self.frozen_now:
+            delay = (upcoming[0] - self.now()).total_seconds() + 0.001
+            self.timer = threading.Timer(min(max(delay, 0), threading.TIMEOUT_MAX), self._flip)
+            self.timer.daemon = True
+            self.timer.start()
+
+
 class Config(_Overridable):
     """
     We have two types of configuration.  One is the values which come directly from our config file, such
@@ -116,6 +209,14 @@ class Config(_Overridable):
         except Exception as e:
             return {}
 
+    @property
+    def POST_CON(self):
+        return self.AFTER_ESCHATON
+
+    @property
+    def PRE_CON(self):
+        return not self.AT_THE_CON and not self.POST_CON
+
     @property
     def HTTP_METHOD(self):
         return cherrypy.request.method
@@ -128,39 +229,82 @@ class Config(_Overridable):
     def ADMIN_ACCESS_SET(self):
         return sa.AdminAccount.access_set()
 
+    @request_cached_property
+    def EMAIL_APPROVED_IDENTS(self):
+        with sa.Session() as session:
+            return {ident for ident, in session.cached(session.query(sa.ApprovedEmail.ident))}
+
     def __getattr__(self, name):
+        getter = _getters.get(name)
+        if getter is None:
+            getter = self._resolve(name)
+            if getter is None:
+                raise AttributeError('no such attribute {}'.format(name))
+            _getters[name] = getter
+        return getter()
+
+    def _resolve(self, name):
+        """
+        Works out where a config value which isn't set directly on this object comes from, and returns a function
+        which returns its current value, or None if there's no such value.  __getattr__ caches these getters by
+        name, so all of the string checks below happen once per name rather than on every access; unknown names
+        aren't cached, since they may be set later (e.g. by plugins calling make_dates).  Values which come straight
+        from our config file are read from the flattened _snapshot dict.
+        """
         if name.split('_')[0] in ['BEFORE', 'AFTER']:
-            date_setting = getattr(c, name.split('_', 1)[1])
-            if not date_setting:
-                return False
-            elif name.startswith('BEFORE_'):
-                return sa.localized_now() < date_setting
-            else:
-                return sa.localized_now() > date_setting
+            # dates from make_dates() have these set as attributes by our DeadlineTimeline, so we only get here
+            # for datetimes which were set directly on the c object
+            date_name = name.split('_', 1)[1]
+
+            def getter():
+                date_setting = getattr(c, date_name)
+                if not date_setting:
+                    return False
+                elif name.startswith('BEFORE_'):
+                    return not deadlines.has_passed(date_setting)
+                else:
+                    return deadlines.has_passed(date_setting)
+
         elif name.startswith('HAS_') and name.endswith('_ACCESS'):
-            return getattr(c, '_'.join(name.split('_')[1:-1])) in c.ADMIN_ACCESS_SET
+            access_name = '_'.join(name.split('_')[1:-1])
+
+            def getter():
+                return getattr(c, access_name) in c.ADMIN_ACCESS_SET
+
         elif name.endswith('_COUNT'):
             item_check = name.rsplit('_', 1)[0]
-            badge_type = getattr(self, item_check, None)
-            return self.get_badge_count_by_type(badge_type) if badge_type else None
+
+            def getter():
+                counter = sa.counters.get(item_check)
+                return counter.get() if counter else None
+
         elif name.endswith('_AVAILABLE'):
             item_check = name.rsplit('_', 1)[0]
-            stock_setting = getattr(self, item_check + '_STOCK', None)
-            count_check = getattr(self, item_check + '_COUNT', None)
-            if count_check is None:
-                return False  # Things with no count are never considered available
-            elif stock_setting is None:
-                return True  # Defaults to unlimited stock for any stock not configured
-            else:
-                return int(count_check) < int(stock_setting)
+
+            def getter():
+                stock_setting = getattr(c, item_check + '_STOCK', None)
+                count_check = getattr(c, item_check + '_COUNT', None)
+                if count_check is None:
+                    return False  # Things with no count are never considered available
+                elif stock_setting is None:
+                    return True  # Defaults to unlimited stock for any stock not configured
+                else:
+                    return int(count_check) < int(stock_setting)
+
         elif hasattr(_secret, name):
-            return getattr(_secret, name)
-        elif name.lower() in _config:
-            return _config[name.lower()]
-        elif name.lower() in _config['secret']:
-            return _config['secret'][name.lower()]
+            def getter():
+                return getattr(_secret, name)
+
+        elif name.lower() in _snapshot:
+            key = name.lower()
+
+            def getter():
+                return _snapshot[key]
+
         else:
-            raise AttributeError('no such attribute {}'.format(name))
+            return None
+
+        return getter
 
 
 class SecretConfig(_Overridable):
@@ -185,10 +329,26 @@ class SecretConfig(_Overridable):
 
 c = Config()
 _secret = SecretConfig()
+deadlines = DeadlineTimeline()
 
 _config = parse_config(__file__)  # outside this module, we use the above c global instead of using this directly
 
 
+def _flatten_config(config):
+    """
+    Returns a read-only, single-level dict of every option which c looks up
+    from our config file, keyed by lowercased option name.  Top-level options
+    and sections take precedence over options in the [secret] section, which
+    is the order in which we've always checked them.
+    """
+    snapshot = dict(config['secret'])
+    snapshot.update(config)
+    return MappingProxyType(snapshot)
+
+_snapshot = _flatten_config(_config)
+_getters = {}  # attribute name -> function returning its value, filled in lazily by Config.__getattr__
+
+
 def _unrepr(d):
     for opt in d:
         val = d[opt]
@@ -199,44 +359,114 @@ def _unrepr(d):
         elif isinstance(d[opt], dict):
             _unrepr(d[opt])
 
-_unrepr(_config['appconf'])
-c.APPCONF = _config['appconf'].dict()
+
+def _is_intstr(s):
+    if s and s[0] in ('-', '+'):
+        return s[1:].isdigit()
+    return s.isdigit()
+
+
+def _apply_config(config):
+    """
+    Sets all of the values on the global c object which we derive from our
+    config file rather than looking up on demand: the timezone, our dates
+    (along with their BEFORE_/AFTER_ flags), and our enums.  This runs once
+    at startup and again every time the config is reloaded.
+    """
+    _unrepr(config['appconf'])
+    c.APPCONF = config['appconf'].dict()
+    c.EVENT_TIMEZONE = pytz.timezone(config['event_timezone'])
+
+    c.make_dates(config['dates'])
+
+    # Under certain conditions, we want to completely remove certain payment options from the system.
+    # However, doing so cleanly also risks an exception being raised if these options are referenced elsewhere in
+    # the code (i.e., c.STRIPE). So we create an enum val to allow code to check for these variables without exceptions.
+    c.make_enums(config['enums'])
+
+    for _name, _val in config['integer_enums'].items():
+        if isinstance(_val, int):
+            setattr(c, _name.upper(), _val)
+
+    for _name, _section in config['integer_enums'].items():
+        if isinstance(_section, dict):
+            _interpolated = OrderedDict()
+            for _desc, _val in _section.items():
+                if _is_intstr(_val):
+                    _price = int(_val)
+                else:
+                    _price = getattr(c, _val.upper())
+
+                _interpolated[_desc] = _price
+
+            c.make_enum(_name, _interpolated, prices=_name.endswith('_price'))
 
 c.DATES = {}
 c.TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
 c.DATE_FORMAT = '%Y-%m-%d'
-c.EVENT_TIMEZONE = pytz.timezone(c.EVENT_TIMEZONE)
 
-c.make_dates(_config['dates'])
+_apply_config(_config)
 
 
-def _is_intstr(s):
-    if s and s[0] in ('-', '+'):
-        return s[1:].isdigit()
-    return s.isdigit()
+_reload_lock = RLock()
+_reload_listeners = []
 
 
-# Under certain conditions, we want to completely remove certain payment options from the system.
-# However, doing so cleanly also risks an exception being raised if these options are referenced elsewhere in the code
-# (i.e., c.STRIPE). So we create an enum val to allow code to check for these variables without exceptions.
-c.make_enums(_config['enums'])
+def on_config_reload(func):
+    """Registers a function to be called with no arguments after each time reload_config() runs."""
+    _reload_listeners.append(func)
+    return func
 
-for _name, _val in _config['integer_enums'].items():
-    if isinstance(_val, int):
-        setattr(c, _name.upper(), _val)
 
-for _name, _section in _config['integer_enums'].items():
-    if isinstance(_section, dict):
-        _interpolated = OrderedDict()
-        for _desc, _val in _section.items():
-            if _is_intstr(_val):
-                _price = int(_val)
-            else:
-                _price = getattr(c, _val.upper())
+def reload_config():
+    """
+    Re-parses our config files and swaps the new values into the global c
+    object without restarting the server, so database connection pools and
+    our in-memory caches stay warm.  The flattened snapshot which c reads from
+    is replaced in a single assignment, so a request never sees a mix of old
+    and new config file values; enums and dates are then re-applied.
+
+    Some settings are only read once at startup (e.g. [appconf], which is
+    passed to cherrypy when we mount our site, or the database URL) so
+    changing those still requires a restart.  Plugin config is not re-read.
+
+    Returns the names of the top-level options whose values changed.
+    """
+    global _config, _snapshot
+    config = parse_config(__file__)
+    snapshot = _flatten_config(config)
+    with _reload_lock:
+        changed = sorted(name for name in set(snapshot).union(_snapshot) if snapshot.get(name) != _snapshot.get(name))
+        removed_dates = {name: '' for name in _config['dates'] if name not in config['dates']}
+        _config, _snapshot = config, snapshot
+        _getters.clear()
+        c.make_dates(removed_dates)  # dates which were deleted from the config file are reset as if left blank
+        _apply_config(config)
+
+    for func in _reload_listeners:
+        func()
+    log.info('reloaded config, changed options: {}', ', '.join(changed) or 'none')
+    return changed
+
+
+_config_mtimes = {}
+
+
+def _config_file_mtimes():
+    from sideboard.config import get_config_files
+    return {path: os.stat(path).st_mtime for path in get_config_files(__file__, True) if exists(path)}
+
 
-            _interpolated[_desc] = _price
+def _check_config_files():
+    """Reloads our config if any of our config files have been modified since we last checked."""
+    mtimes = _config_file_mtimes()
+    if _config_mtimes and mtimes != _config_mtimes:
+        reload_config()
+    _config_mtimes.clear()
+    _config_mtimes.update(mtimes)
 
-        c.make_enum(_name, _interpolated, prices=_name.endswith('_price'))
+if c.CONFIG_RELOAD_INTERVAL:
+    DaemonTask(_check_config_files, interval=c.CONFIG_RELOAD_INTERVAL, name='config reload')
 
 # plugins can use this to append paths which will be included as <script> tags, e.g. if a plugin
 # appends '../static/foo.js' to this list, that adds <script src="../static/foo.js"></script> to
@@ -0,0 +1,129 @@
+from darecms.common import *
+
+
+def _filter_value(val):
+    """
+    Filter values in the [counters] section are Python literals, e.g. True or
+    'some text', or else "c.SOME_NAME" to refer to one of our enum values.
+    Anything else is treated as a plain string.
+    """
+    if val.startswith('c.'):
+        return getattr(c, val[2:])
+    try:
+        return ast.literal_eval(val)
+    except (ValueError, SyntaxError):
+        return val
+
+
+class Counter:
+    """
+    A running count of the rows of one model which match a set of filters.
+    Rather than running a COUNT query every time someone checks the count, we
+    run it once and then keep the number up to date by adding or subtracting
+    one for each matching row our sessions create, update, or delete; see
+    Counters.record() below.  Writes made by other processes don't reach us,
+    so every counter is periodically reconciled against a real COUNT.
+    """
+
+    def __init__(self, name, model, filters):
+        self.name, self.model, self.filters = name, model, filters
+        self.lock = RLock()
+        self.value = None  # None until we've run our first real COUNT
+
+    def matches(self, instance, original=False):
+        for attr, val in self.filters.items():
+            current = instance.orig_value_of(attr) if original else getattr(instance, attr)
+            if current != val:
+                return False
+        return True
+
+    def delta(self, instance, action):
+        if action == c.CREATED:
+            return int(self.matches(instance))
+        elif action == c.DELETED:
+            return -int(self.matches(instance, original=True))
+        else:
+            return int(self.matches(instance)) - int(self.matches(instance, original=True))
+
+    def count(self):
+        with Session() as session:
+            return session.query(self.model).filter_by(**self.filters).count()
+
+    def reconcile(self):
+        """Replaces our running count with a real COUNT, returning how far off we were (or None if never counted)."""
+        actual = self.count()
+        with self.lock:
+            drift = None if self.value is None else actual - self.value
+            self.value = actual
+        return drift
+
+    def add(self, delta):
+        with self.lock:
+            if self.value is not None:
+                self.value += delta
+
+    def get(self):
+        if self.value is None:
+            self.reconcile()
+        return self.value
+
+
+class Counters:
+    """
+    All of the counters declared in the [counters] section of our config.  A
+    counter called "foo" is exposed as c.FOO_COUNT, and if c.FOO_STOCK is also
+    set then c.FOO_AVAILABLE says whether we're still below that limit.  Both
+    of these are plain in-memory reads after the first time they're used.
+    """
+
+    def __init__(self):
+        self.lock = RLock()
+        self.counters = None
+
+    def _ensure_loaded(self):
+        with self.lock:
+            if self.counters is None:
+                self.counters = {}
+                for name, section in c.COUNTERS.items():
+                    filters = {attr: _filter_value(val) for attr, val in section.get('filters', {}).items()}
+                    self.counters[name.upper()] = Counter(name.upper(), getattr(sa, section['model']), filters)
+            return self.counters
+
+    def reset(self):
+        """Forget all of our counters so that they're re-read from config the next time they're used."""
+        with self.lock:
+            self.counters = None
+
+    def get(self, name):
+        return self._ensure_loaded().get(name.upper())
+
+    def record(self, session):
+        """Works out how the pending changes in this session will change each counter; called before each flush."""
+        deltas = session.info.setdefault('counter_deltas', defaultdict(int))
+        for counter in self._ensure_loaded().values():
+            for action, instances in [(c.CREATED, session.new), (c.UPDATED, session.dirty), (c.DELETED, session.deleted)]:
+                for instance in instances:
+                    if isinstance(instance, counter.model):
+                        deltas[counter.name] += counter.delta(instance, action)
+
+    def apply(self, deltas):
+        for name, delta in deltas.items():
+            counter = self.get(name)
+            if counter and delta:
+                counter.add(delta)
+
+    def reconcile(self):
+        """Re-counts every counter we've started using, logging any which had drifted (e.g. from other processes)."""
+        drifts = {}
+        for counter in list(self._ensure_loaded().values()):
+            if counter.value is not None:
+                drifts[counter.name] = counter.reconcile()
+                if drifts[counter.name]:
+                    log.info('{} counter was off by {}, reset to {}', counter.name, drifts[counter.name], counter.value)
+        return drifts
+
+counters = Counters()
+on_config_reload(counters.reset)
+
+if c.COUNTER_RECONCILE_INTERVAL:
+    DaemonTask(counters.reconcile, interval=c.COUNTER_RECONCILE_INTERVAL, name='counter reconciliation')
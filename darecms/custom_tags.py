@@ -201,6 +201,88 @@ def email_only(email):
     return re.search(c.EMAIL_RE.lstrip('^').rstrip('$'), email).group()
 
 
+class _RenderedOptions:
+    """
+    The HTML for a list of <option> tags, escaped once and then reused every
+    time we render a dropdown for the same list of options.  Only the
+    selected="selected" marker differs between calls, so we keep both the
+    selected and unselected markup for each option along with an index from
+    each option value to its position, which is how we find the option(s)
+    to mark as selected.
+    """
+
+    def __init__(self, options):
+        self.unselected, self.selected = [], []
+        self.str_index, self.datetime_index = defaultdict(list), defaultdict(list)
+        for i, opt in enumerate(options):
+            if len(listify(opt)) == 1:
+                opt = [opt, opt]
+            val, desc = opt
+            if isinstance(val, datetime):
+                self.datetime_index[val].append(i)
+                val = val.strftime(c.TIMESTAMP_FORMAT)
+            else:
+                self.str_index[str(val)].append(i)
+            val  = html.escape(str(val), quote=False).replace('"',  '&quot;').replace('\n', '')
+            desc = html.escape(str(desc), quote=False).replace('"', '&quot;').replace('\n', '')
+            self.unselected.append('<option value="{}" >{}</option>'.format(val, desc))
+            self.selected.append('<option value="{}" selected="selected">{}</option>'.format(val, desc))
+        self.all_unselected = safe_string('\n'.join(self.unselected))
+
+    def render(self, default):
+        selected = self.str_index.get(str(default), [])
+        if isinstance(default, datetime):
+            selected = selected + self.datetime_index.get(default, [])
+
+        if not selected:
+            return self.all_unselected
+
+        results = list(self.unselected)
+        for i in selected:
+            results[i] = self.selected[i]
+        return safe_string('\n'.join(results))
+
+
+class _OptionsCache:
+    """
+    Bounded LRU of _RenderedOptions, keyed by the contents of the options
+    list, so that lists which plugins modify in place (e.g. c.COUNTRY_OPTS)
+    and lists built fresh for each request are both rendered correctly.
+    Options lists containing unhashable values are rendered without caching.
+    """
+
+    def __init__(self, max_size=200):
+        self.max_size = max_size
+        self.lock = RLock()
+        self.entries = OrderedDict()
+
+    @staticmethod
+    def key(options):
+        return tuple(tuple(opt) if isinstance(opt, list) else opt for opt in options)
+
+    def get(self, options):
+        try:
+            key = self.key(options)
+            hash(key)
+        except TypeError:
+            return _RenderedOptions(options)
+
+        with self.lock:
+            rendered = self.entries.get(key)
+            if rendered:
+                self.entries.move_to_end(key)
+                return rendered
+
+        rendered = _RenderedOptions(options)
+        with self.lock:
+            self.entries[key] = rendered
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return rendered
+
+_options_cache = _OptionsCache()
+
+
 @JinjaEnv.jinja_export
 def options(options, default='""'):
     """
@@ -210,29 +292,16 @@ def options(options, default='""'):
     if isinstance(default, datetime):
         default = default.astimezone(c.EVENT_TIMEZONE)
 
-    results = []
-    for opt in options:
-        if len(listify(opt)) == 1:
-            opt = [opt, opt]
-        val, desc = opt
-        if isinstance(val, datetime):
-            selected = 'selected="selected"' if val == default else ''
-            val = val.strftime(c.TIMESTAMP_FORMAT)
-        else:
-            selected = 'selected="selected"' if str(val) == str(default) else ''
-        val  = html.escape(str(val), quote=False).replace('"',  '&quot;').replace('\n', '')
-        desc = html.escape(str(desc), quote=False).replace('"', '&quot;').replace('\n', '')
-        results.append('<option value="{}" {}>{}</option>'.format(val, selected, desc))
-    return safe_string('\n'.join(results))
+    if not isinstance(options, (list, tuple)):
+        options = list(options)
+
+    return _options_cache.get(options).render(default)
 
 
 @JinjaEnv.jinja_export
 def int_options(minval, maxval, default=1):
-    results = []
-    for i in range(minval, maxval+1):
-        selected = 'selected="selected"' if i == default else ''
-        results.append('<option value="{val}" {selected}>{val}</option>'.format(val=i, selected=selected))
-    return safe_string('\n'.join(results))
+    rendered = _options_cache.get(tuple(range(minval, maxval + 1)))
+    return rendered.render(int(default)) if default in range(minval, maxval + 1) else rendered.all_unselected
 
 
 @JinjaEnv.jinja_export
@@ -305,6 +374,6 @@ def rerender(value, obj=None):
         obj.__class__.__name__: obj
     }
     data = renderable_data(data)
-    template = jinja2.Template(value)
+    template = compiled_templates.get(value)
     rendered = template.render(data)
     return rendered
\ No newline at end of file
@@ -161,6 +161,19 @@ def cached(func):
     return func
 
 
+def streamed(func):
+    """
+    Render this page's template in chunks which are sent to the browser as
+    they're rendered, rather than building the whole page in memory first.
+    Use this for large pages such as long lists of users.  Errors raised
+    while rendering the first chunk still show our normal error page, but
+    once we've started sending the page it's too late for that, so the page
+    will just be cut off.  This is ignored for @cached pages.
+    """
+    func.streamed = True
+    return func
+
+
 def cached_page(func):
     from sideboard.lib import config as sideboard_config
     innermost = get_innermost(func)
@@ -204,9 +217,13 @@ def sessionized(func):
         if 'session' not in inspect.getfullargspec(innermost).args:
             return func(*args, **kwargs)
         else:
-            with sa.Session() as session:
+            with ExitStack() as stack:
+                session = stack.enter_context(sa.Session())
                 try:
                     retval = func(*args, session=session, **kwargs)
+                    if inspect.isgenerator(retval):
+                        # streamed pages are rendered after we return, so their session stays open until they finish
+                        return _close_after(retval, stack.pop_all())
                     session.expunge_all()
                     return retval
                 except HTTPRedirect:
@@ -215,6 +232,11 @@ def sessionized(func):
     return with_session
 
 
+def _close_after(chunks, stack):
+    with stack:
+        yield from chunks
+
+
 def renderable_data(data=None):
     data = data or {}
     data['c'] = c
@@ -234,6 +256,39 @@ def render(template_name_list, data=None):
     return rendered.encode('utf-8')
 
 
+def render_stream(template_name_list, data=None):
+    """
+    Like render(), but returns a generator of utf-8 encoded chunks of roughly
+    c.STREAM_CHUNK_SIZE characters, for pages marked with @streamed.  We render
+    the first chunk before returning, so that exceptions raised near the top
+    of the template still produce our normal error page.
+    """
+    data = renderable_data(data)
+    env = JinjaEnv.env()
+    template = env.get_template(template_name_list)
+    chunks = _buffered_chunks(template.generate(data), c.STREAM_CHUNK_SIZE)
+    first = next(chunks, b'')
+    cherrypy.response.stream = True
+    return _prepend(first, chunks)
+
+
+def _buffered_chunks(fragments, size):
+    buffer, length = [], 0
+    for fragment in fragments:
+        buffer.append(fragment)
+        length += len(fragment)
+        if length >= size:
+            yield ''.join(buffer).encode('utf-8')
+            buffer, length = [], 0
+    if buffer:
+        yield ''.join(buffer).encode('utf-8')
+
+
+def _prepend(first, chunks):
+    yield first
+    yield from chunks
+
+
 def render_empty(template_name_list):
     env = JinjaEnv.env()
     template = env.get_or_select_template(template_name_list)
@@ -270,7 +325,11 @@ def renderable(func):
         if c.UBER_SHUT_DOWN and not cherrypy.request.path_info.startswith('/schedule'):
             return render('closed.html')
         elif isinstance(result, dict):
-            return render(_get_template_filename(func, suffix=result.get('suffix')), result)
+            template_name = _get_template_filename(func, suffix=result.get('suffix'))
+            innermost = get_innermost(func)
+            if getattr(innermost, 'streamed', False) and not hasattr(innermost, 'cached'):
+                return render_stream(template_name, result)
+            return render(template_name, result)
         else:
             return result
     return with_rendering
@@ -1,4 +1,218 @@
 from darecms.common import *
+from jinja2 import nodes
+from jinja2.runtime import Macro
+from jinja2.ext import Extension
+from jinja2.sandbox import SandboxedEnvironment
+
+
+class FragmentCacheExtension(Extension):
+    """
+    Adds a {% cache %} tag which renders part of a template once and then
+    reuses the output until it expires or one of the tables it depends on
+    is changed, e.g.
+
+        {% cache "admin_sidebar", 300, tables=["user", "admin_account"] %}
+            ...
+        {% endcache %}
+
+    The first argument is the cache key, which can be any expression, and
+    the optional second argument is the number of seconds to keep the output
+    (defaulting to the ttl of the "fragments" query cache region).  Cached
+    output is thrown away as soon as we commit a change to any of the named
+    tables, the same way as query results cached with Session.cached().
+
+    By default we cache separate output for each distinct set of admin access
+    levels, since most of our pages show different things to different
+    admins.  Pass vary_on_access=False for fragments which look the same for
+    everyone.
+    """
+
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args, kwargs = [], []
+        while parser.stream.current.type != 'block_end':
+            if args or kwargs:
+                parser.stream.expect('comma')
+            if parser.stream.current.type == 'name' and parser.stream.look().type == 'assign':
+                name = next(parser.stream).value
+                next(parser.stream)
+                kwargs.append(nodes.Keyword(name, parser.parse_expression(), lineno=lineno))
+            else:
+                args.append(parser.parse_expression())
+
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(self.call_method('_cache', args, kwargs), [], [], body).set_lineno(lineno)
+
+    def _cache(self, key, ttl=None, tables=(), vary_on_access=True, caller=None):
+        key = str(key)
+        if vary_on_access:
+            key += ':{}'.format(sorted(c.ADMIN_ACCESS_SET))
+
+        region = sa.query_cache.region('fragments')
+        rendered = region.get(key)
+        if rendered is None:
+            rendered = caller()
+            region.set(key, rendered, frozenset(listify(tables)), ttl=ttl)
+        return rendered
+
+
+class RenderProfile:
+    """
+    When c.TEMPLATE_PROFILING is on, we record how long each request spends
+    rendering each template, block, and macro, and which SQL queries run while
+    each of them is rendering (typically lazy loads of relationships which
+    weren't loaded before our page handler returned).  Times are exclusive, so
+    a template which includes another one isn't charged for the time spent in
+    the included template.  Queries run outside of any template are charged to
+    "(handler)".
+
+    The most recent profiles are kept in memory for the render_profiles debug
+    page, and each one is also logged as a line of JSON.
+    """
+    _current = local()
+    recent = deque(maxlen=50)
+
+    def __init__(self):
+        self.started = datetime.now(UTC)
+        self.started_at = self.mark = perf_counter()
+        self.stack = []
+        self.stats = defaultdict(lambda: {'calls': 0, 'seconds': 0.0, 'queries': 0, 'query_seconds': 0.0})
+        self.queries = []
+
+    @classmethod
+    def current(cls):
+        return getattr(cls._current, 'profile', None)
+
+    @classmethod
+    def start(cls):
+        if c.TEMPLATE_PROFILING:
+            cls._current.profile = cls()
+
+    @classmethod
+    def finish(cls, path):
+        profile = cls.current()
+        if profile:
+            cls._current.profile = None
+            profile.path = path
+            profile.total_seconds = perf_counter() - profile.started_at
+            if profile.stats:
+                cls.recent.appendleft(profile)
+                log.info('render profile: {}', json.dumps(profile.to_dict(), sort_keys=True))
+
+    def _charge(self):
+        now = perf_counter()
+        if self.stack:
+            self.stats[self.stack[-1]]['seconds'] += now - self.mark
+        self.mark = now
+
+    def enter(self, name, new_call=False):
+        self._charge()
+        self.stack.append(name)
+        if new_call:
+            self.stats[name]['calls'] += 1
+
+    def exit(self):
+        self._charge()
+        self.stack.pop()
+
+    def record_query(self, statement, seconds):
+        name = self.stack[-1] if self.stack else '(handler)'
+        self.stats[name]['queries'] += 1
+        self.stats[name]['query_seconds'] += seconds
+        self.queries.append({'template': name, 'seconds': seconds, 'statement': statement[:500]})
+
+    def to_dict(self):
+        return {
+            'path': self.path,
+            'started': self.started.isoformat(),
+            'total_seconds': self.total_seconds,
+            'render_seconds': sum(stats['seconds'] for stats in self.stats.values()),
+            'query_count': len(self.queries),
+            'templates': sorted([dict(stats, name=name) for name, stats in self.stats.items()],
+                                key=lambda stats: stats['seconds'], reverse=True),
+            'slowest_queries': sorted(self.queries, key=lambda query: query['seconds'], reverse=True)[:10]
+        }
+
+
+def _profiled(name, render_func):
+    """
+    Wraps one of the generator functions which Jinja compiles each template
+    and block into.  We step out of the profile each time we yield output,
+    since our caller may be another template (or a streamed response).
+    """
+    @wraps(render_func)
+    def profiled_render(context):
+        profile = RenderProfile.current()
+        if not profile:
+            yield from render_func(context)
+            return
+
+        profile.enter(name, new_call=True)
+        try:
+            for event in render_func(context):
+                profile.exit()
+                try:
+                    yield event
+                finally:
+                    profile.enter(name)
+        finally:
+            profile.exit()
+    return profiled_render
+
+
+class ProfiledTemplate(jinja2.Template):
+    """
+    Template class used by our environment when c.TEMPLATE_PROFILING is on,
+    which times the rendering of the template itself and each of its blocks.
+    Includes and extends go through the same render functions, so they're
+    timed separately under their own template names.
+    """
+
+    @classmethod
+    def _from_namespace(cls, environment, namespace, globals):
+        template = super()._from_namespace(environment, namespace, globals)
+        name = template.name or '(string)'
+        template.root_render_func = _profiled(name, template.root_render_func)
+        template.blocks = {block: _profiled('{} block {}'.format(name, block), func)
+                           for block, func in template.blocks.items()}
+        return template
+
+
+def _profile_macros():
+    invoke = Macro._invoke
+
+    @wraps(invoke)
+    def profiled_invoke(self, arguments, autoescape):
+        profile = RenderProfile.current()
+        if not profile:
+            return invoke(self, arguments, autoescape)
+
+        profile.enter('macro ' + self.name, new_call=True)
+        try:
+            return invoke(self, arguments, autoescape)
+        finally:
+            profile.exit()
+
+    Macro._invoke = profiled_invoke
+
+
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    if RenderProfile.current():
+        conn.info.setdefault('render_profile_query_start', []).append(perf_counter())
+
+
+def _record_query_time(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('render_profile_query_start')
+    if started:
+        seconds = perf_counter() - started.pop()
+        profile = RenderProfile.current()
+        if profile:
+            profile.record_query(statement, seconds)
+
+listen(sqlalchemy.engine.Engine, 'before_cursor_execute', _start_query_timer)
+listen(sqlalchemy.engine.Engine, 'after_cursor_execute', _record_query_time)
 
 
 class JinjaEnv:
@@ -27,8 +241,15 @@ class JinjaEnv:
     def _init_env(cls):
         env = jinja2.Environment(
             autoescape=True,
+            auto_reload=c.TEMPLATE_AUTO_RELOAD,
+            extensions=[FragmentCacheExtension],
+            bytecode_cache=cls._bytecode_cache(),
             loader=jinja2.FileSystemLoader(cls._template_dirs))
 
+        if c.TEMPLATE_PROFILING:
+            env.template_class = ProfiledTemplate
+            _profile_macros()
+
         for name, func in cls._exportable_functions.items():
             env.globals[name] = func
 
@@ -37,6 +258,38 @@ class JinjaEnv:
 
         return env
 
+    @classmethod
+    def _bytecode_cache(cls):
+        """
+        Compiled templates are saved to disk so that new server processes can
+        load them instead of parsing and compiling every template again.
+        """
+        cache_dir = c.TEMPLATE_CACHE_DIR
+        if not cache_dir:
+            from sideboard.lib import config as sideboard_config
+            cache_dir = join(sideboard_config['root'], 'data', 'jinja_cache')
+        os.makedirs(cache_dir, exist_ok=True)
+        return jinja2.FileSystemBytecodeCache(cache_dir)
+
+    @classmethod
+    def compile_templates(cls):
+        """
+        Compiles every template in our template directories (including those
+        added by plugins) into our bytecode cache ahead of time.  Returns the
+        number of templates compiled and a dict of template names which failed
+        to compile mapped to their errors.
+        """
+        env = cls.env()
+        compiled, errors = 0, {}
+        for name in env.list_templates():
+            try:
+                env.get_template(name)
+            except (jinja2.TemplateError, UnicodeDecodeError) as e:
+                errors[name] = e
+            else:
+                compiled += 1
+        return compiled, errors
+
     @classmethod
     def jinja_export(cls, name=None):
         def _register(func, _name=None):
@@ -72,6 +325,61 @@ class JinjaEnv:
             return registrar
 
 
+class CompiledTemplateCache:
+    """
+    Bounded LRU cache of templates compiled from strings, such as text which
+    admins write into our database and which we render with the rerender
+    filter.  Parsing and compiling a template is far slower than rendering it,
+    so each distinct template source is only compiled once.  Templates are
+    keyed by a hash of their source, so edited text simply gets a new entry
+    and the old one eventually falls out of the cache.
+
+    These templates are written by users rather than developers, so they're
+    compiled in a sandboxed environment which shares our registered filters.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.lock = RLock()
+        self.templates = OrderedDict()
+        self.hits = self.misses = 0
+        self._env = None
+
+    @property
+    def env(self):
+        if self._env is None:
+            self._env = SandboxedEnvironment()
+            self._env.filters = JinjaEnv.env().filters  # shared, so filters registered later are available too
+        return self._env
+
+    def get(self, source):
+        key = sha512(source.encode('utf-8')).hexdigest()
+        with self.lock:
+            template = self.templates.get(key)
+            if template:
+                self.templates.move_to_end(key)
+                self.hits += 1
+                return template
+            self.misses += 1
+
+        template = self.env.from_string(source)
+        with self.lock:
+            self.templates[key] = template
+            while len(self.templates) > self.max_size:
+                self.templates.popitem(last=False)
+        return template
+
+    def stats(self):
+        return {
+            'size': len(self.templates),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+compiled_templates = CompiledTemplateCache(c.RERENDER_CACHE_SIZE)
+
+
 def template_overrides(dirname):
     """
     Each event can have its own plugin and override our default templates with
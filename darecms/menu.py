@@ -7,6 +7,8 @@ class MenuItem:
     submenu = None  # submenu to show
     name = None     # name of Menu item to show
 
+    _compiled = {}  # (id of menu, frozenset of access levels) -> filtered menu dict
+
     def __init__(self, href=None, access=None, submenu=None, name=None, priority=None):
         assert submenu or href, "menu items must contain ONE nonempty: href or submenu"
         assert not submenu or not href, "menu items must not contain both a href and submenu"
@@ -49,27 +51,65 @@ class MenuItem:
             self.href = None
 
         self.submenu.append(m)
+        MenuItem._compiled.clear()
 
     def render_items_filtered_by_current_access(self):
         """
-        Returns: dict of menu items which are allowed to be seen by the logged in user's access levels
+        Returns: the menu items which are allowed to be seen by the logged in user's access levels, with the
+        Jinja snippets in their names and hrefs rendered for the current request
+        """
+        return self._render(self.render_items_filtered_by_access(c.ADMIN_ACCESS_SET), renderable_data())
+
+    def render_items_filtered_by_access(self, access_set):
+        """
+        Returns: the menu items which are allowed to be seen by someone with the given access levels, as a
+        read-only mapping whose submenu is a tuple of read-only mappings
+
+        Most admins share one of a handful of combinations of access levels, so
+        we build the filtered menu once per combination and return the same
+        menu afterwards.  Names and hrefs which contain Jinja snippets are
+        compiled into templates at that point, and everything else is kept as a
+        plain string.  This cache is cleared whenever an item is appended to any
+        menu.
         """
+        key = (id(self), frozenset(access_set))
+        if key not in MenuItem._compiled:
+            MenuItem._compiled[key] = self._filter_by_access(key[1])
+        return MenuItem._compiled[key]
+
+    def _filter_by_access(self, access_set):
         out = {}
 
-        if self.access and set(listify(self.access)).isdisjoint(sa.AdminAccount.access_set()):
+        if self.access and set(listify(self.access)).isdisjoint(access_set):
             return None
 
-        out['name'] = self.name
+        out['name'] = self._compile(self.name)
         if self.submenu:
-            out['submenu'] = []
-            for menu_item in sorted(sorted(self.submenu, key=lambda x: x.name), key=lambda x: x.priority):
-                filtered_menu_items = menu_item.render_items_filtered_by_current_access()
+            submenu = []
+            for menu_item in sorted(self.submenu, key=lambda x: (x.priority, x.name)):
+                filtered_menu_items = menu_item._filter_by_access(access_set)
                 if filtered_menu_items:
-                    out['submenu'].append(filtered_menu_items)
+                    submenu.append(filtered_menu_items)
+            out['submenu'] = tuple(submenu)
         else:
-            out['href'] = self.href
+            out['href'] = self._compile(self.href)
+
+        return MappingProxyType(out)
 
-        return out
+    @staticmethod
+    def _compile(snippet):
+        return JinjaEnv.env().from_string(snippet) if snippet and '{' in snippet else snippet
+
+    @classmethod
+    def _render(cls, item, data):
+        if item is None:
+            return None
+
+        rendered = {key: value.render(data) if isinstance(value, jinja2.Template) else value
+                    for key, value in item.items() if key != 'submenu'}
+        if 'submenu' in item:
+            rendered['submenu'] = tuple(cls._render(menu_item, data) for menu_item in item['submenu'])
+        return MappingProxyType(rendered)
 
     def __getitem__(self, key):
         for sm in self.submenu:
@@ -93,3 +133,16 @@ c.MENU = MenuItem(name='Root', submenu=[
              priority=100000),
     MenuItem(name="Sitemap", href="{{ c.PATH }}/accounts/sitemap", priority=99999, access=[c.PEOPLE])
 ])
+
+
+def compile_menu():
+    """
+    Builds the filtered admin menu ahead of time for every distinct set of
+    access levels held by our admin accounts, plus the logged-out menu.
+    """
+    c.MENU.render_items_filtered_by_access(set())
+    with Session() as session:
+        for access, in session.query(AdminAccount.access).distinct():
+            c.MENU.render_items_filtered_by_access({int(level) for level in (access or '').split(',') if level})
+
+on_startup(compile_menu)
@@ -130,6 +130,24 @@ class MultiChoice(TypeDecorator):
     def process_bind_param(self, value, dialect):
         return value if isinstance(value, str) else ','.join(value)
 
+
+class TSVector(TypeDecorator):
+    """
+    Utility class for storing a Postgres full-text search document.  On other
+    databases (i.e. SQLite in development) this is just a text column; those
+    databases search an FTS5 table instead, see _register_search_ddl() below.
+
+    Columns of this type hold a SQL expression until they're flushed, so we
+    don't record them in our Tracking history.
+    """
+    impl = sqlalchemy.types.UnicodeText
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'postgresql':
+            return dialect.type_descriptor(postgresql.TSVECTOR())
+        return dialect.type_descriptor(sqlalchemy.types.UnicodeText())
+
+
 @declarative_base
 class MainModel:
     id = Column(UUID, primary_key=True, default=lambda: str(uuid4()))
@@ -416,8 +434,60 @@ class Session(SessionManager):
                 query = self.filter(attr.ilike('%{}%'.format(val)))
             return query
 
+        def icontains_condition(self, attr=None, val=None, **filters):
+            """
+            Returns a condition which is true when every named column contains
+            the corresponding value, case-insensitive.  On Postgres these ILIKE
+            checks are served by the pg_trgm indexes on the searchable columns.
+            """
+            conds = [getattr(self.model, colname).ilike('%{}%'.format(val)) for colname, val in filters.items()]
+            if attr is not None and val:
+                conds.append(attr.ilike('%{}%'.format(val)))
+            return and_(*conds)
+
         def iexact(self, **filters):
-            return self.filter(*[func.lower(getattr(self.model, attr)) == func.lower(val) for attr, val in filters.items()])
+            """
+            Case-insensitive equality filter.  Columns which have an indexed
+            normalized_<name> shadow column (e.g. User.normalized_email) are
+            compared against that column so the lookup can use its index.
+            """
+            conds = []
+            for attr, val in filters.items():
+                normalized_col = getattr(self.model, 'normalized_' + attr, None)
+                if normalized_col is not None:
+                    conds.append(normalized_col == str(val).strip().lower())
+                else:
+                    conds.append(func.lower(getattr(self.model, attr)) == func.lower(val))
+            return self.filter(*conds)
+
+        def fulltext(self, text):
+            """
+            Filters this query down to rows whose search document matches every
+            word of text (as a prefix, so this works while someone is still
+            typing), ordered with the most relevant rows first.
+
+            On Postgres this uses the model's search_vector column and its GIN
+            index, falling back to trigram matching of the raw text against the
+            model's _trigram_attrs so that fragments like "gmail.c" still match.
+            On SQLite this uses the FTS5 table which mirrors search_text.
+            """
+            words = re.findall(r'\w+', text.lower())
+            if not words:
+                return self
+
+            model = self.model
+            if Session.engine.dialect.name == 'postgresql':
+                tsquery = func.to_tsquery('simple', ' & '.join(word + ':*' for word in words))
+                trigram_cols = [getattr(model, attr) for attr in model._trigram_attrs]
+                rank = func.ts_rank(model.search_vector, tsquery) + func.greatest(*[func.similarity(col, text) for col in trigram_cols])
+                return (self.filter(or_(model.search_vector.op('@@')(tsquery), *[col.ilike('%' + text + '%') for col in trigram_cols]))
+                            .order_by(rank.desc()))
+            else:
+                fts = sqlalchemy.table(model.__tablename__ + '_search', sqlalchemy.column('rowid'), sqlalchemy.column('rank'))
+                match = ' '.join('"{}"*'.format(word) for word in words)
+                return (self.join(fts, fts.c.rowid == literal_column('"{}".rowid'.format(model.__tablename__)))
+                            .filter(literal_column(fts.name).op('MATCH')(match))
+                            .order_by(fts.c.rank))
 
     class SessionMixin:
         def admin_user(self):
@@ -427,7 +497,16 @@ class Session(SessionManager):
             return self.user(cherrypy.session['user_id'])
 
         def get_account_by_email(self, email):
-            return self.query(AdminAccount).join(User).filter(func.lower(User.email) == func.lower(email)).one()
+            return self.query(AdminAccount).join(User).filter(User.normalized_email == User.normalize_email(email)).one()
+
+        def cached(self, query, region='reference'):
+            """
+            Returns the results of query, using our process-wide query cache
+            (see darecms.query_cache) instead of the database when possible.
+            Only use this for small tables which are read far more often than
+            they're written.
+            """
+            return sa.query_cache.get(self, query, region)
 
         def no_email(self, subject):
             return not self.query(Email).filter_by(subject=subject).all()
@@ -436,36 +515,40 @@ class Session(SessionManager):
             return self.query(User).filter(User.verificatio_status != c.INVALID_STATUS)
 
         def search(self, text, *filters):
+            """
+            Returns a query of users matching the search text, most relevant
+            first.  Besides plain text, which is matched against the full-text
+            search document, we support a few special forms:
+                email:someone@example.com   - exact email address, or any part of one
+                Last, First / First Last    - name search
+                Last,                       - last name search
+                (555) 555-5555              - 10-digit phone number, in any format
+                <uuid>                      - user id
+            """
             users = self.query(User).filter(*filters)
             if ':' in text:
                 target, term = text.split(':', 1)
                 if target == 'email':
-                    return users.icontains(User.normalized_email, User.normalize_email(term))
+                    if '@' in term:
+                        return users.filter(User.normalized_email == User.normalize_email(term))
+                    return users.icontains(User.email, term.strip())
+
+            if re.match(r'^[0-9\s().+-]+$', text) and len(User.normalize_phone(text)) == 10:
+                return users.filter(User.cellphone_digits == User.normalize_phone(text))
 
             terms = text.split()
             if len(terms) == 2:
                 first, last = terms
                 if first.endswith(','):
                     last, first = first.strip(','), last
-                name_cond = users.icontains_condition(first_name=first, last_name=last)
-                legal_name_cond = users.icontains_condition(legal_name="{}%{}".format(first, last))
-                return users.filter(or_(name_cond, legal_name_cond))
+                return users.filter(users.icontains_condition(first_name=first, last_name=last))
             elif len(terms) == 1 and terms[0].endswith(','):
                 last = terms[0].rstrip(',')
-                name_cond = users.icontains_condition(last_name=last)
-                # Known issue: search may include first name if legal name is set
-                legal_name_cond = users.icontains_condition(legal_name=last)
-                return users.filter(or_(name_cond, legal_name_cond))
-            elif len(terms) == 1 and terms[0].isdigit():
-                if len(terms[0]) == 10:
-                    return users.filter(or_(User.ec_phone == terms[0], User.cellphone == terms[0]))
+                return users.filter(users.icontains_condition(last_name=last))
             elif len(terms) == 1 and re.match('^[a-z0-9]{8}-[a-z0-9]{4}-[a-z0-9]{4}-[a-z0-9]{4}-[a-z0-9]{12}$', terms[0]):
-                return users.filter(or_(User.id == terms[0], User.public_id == terms[0]))
+                return users.filter(User.id == terms[0])
 
-            checks = []
-            for attr in ['first_name', 'last_name',  'email', 'comments', 'admin_notes']:
-                checks.append(getattr(User, attr).ilike('%' + text + '%'))
-            return users.filter(or_(*checks))
+            return users.fulltext(text)
 
         def insert_test_admin_account(self):
             """
@@ -492,6 +575,43 @@ class Session(SessionManager):
 
             return True
 
+        def claim_email(self, model_inst, ident, **fields):
+            """
+            Records that we're about to send the email identified by ident to
+            this model instance by inserting a pending Email row, and returns
+            the id of that row, or None if the email has already been claimed
+            or sent.  The unique index on (model, fk_id, ident) of automated
+            emails makes this safe even when several processes try to send the
+            same email at once.  Emails which previously failed to send, or
+            whose claim is still pending after c.EMAIL_CLAIM_TIMEOUT seconds
+            (e.g. because the process sending it crashed) can be claimed again.
+
+            Callers should commit before actually sending the email, so that
+            other processes see the claim, and then mark the row as sent or
+            failed afterwards; see Outbox.record_status().
+            """
+            email = Email.__table__
+            key = {'model': model_inst.__class__.__name__, 'fk_id': model_inst.id, 'ident': ident}
+            claimed = dict(fields, status=c.EMAIL_PENDING, when=datetime.now(UTC), automated=True)
+            if Session.engine.dialect.name == 'postgresql':
+                return self.execute(
+                    postgresql.insert(email)
+                        .values(id=str(uuid4()), **dict(key, **claimed))
+                        .on_conflict_do_update(index_elements=list(key), index_where=email.c.automated,
+                                               set_=claimed, where=Email.claimable)
+                        .returning(email.c.id)).scalar()
+
+            try:
+                with self.begin_nested():
+                    email_id = str(uuid4())
+                    self.execute(email.insert().values(id=email_id, **dict(key, **claimed)))
+                    return email_id
+            except sqlalchemy.exc.IntegrityError:
+                matching = [email.c.automated == True] + [email.c[name] == val for name, val in key.items()]
+                reclaimed = self.execute(email.update().where(and_(Email.claimable, *matching)).values(**claimed))
+                if reclaimed.rowcount:
+                    return self.execute(sqlalchemy.select([email.c.id]).where(and_(*matching))).scalar()
+
         def all_users(self, only_verified=False):
             """
             Returns a Query of Attendees with efficient loading for groups and
@@ -534,6 +654,9 @@ class Session(SessionManager):
 class User(MainModel):
     watchlist_id = Column(UUID, ForeignKey('watch_list.id', ondelete='set null'), nullable=True, default=None)
 
+    # comma-separated ids of WatchList entries this user might match, see darecms.watchlist
+    watchlist_guesses = Column(UnicodeText, admin_only=True)
+
     verified   = Column(Boolean, default=False, admin_only=True)
     first_name    = Column(UnicodeText)
     last_name     = Column(UnicodeText)
@@ -543,14 +666,32 @@ class User(MainModel):
     no_cellphone  = Column(Boolean, default=False)
     cellphone     = Column(UnicodeText)
 
+    # lookup columns maintained by _update_normalized_columns(), see Session.QuerySubclass.iexact()
+    normalized_email = Column(UnicodeText, admin_only=True, index=True)
+    cellphone_digits = Column(UnicodeText, admin_only=True, index=True)
+
     found_how   = Column(UnicodeText)
     comments    = Column(UnicodeText)
     admin_notes = Column(UnicodeText, admin_only=True)
 
+    # sort keys maintained by _update_sort_keys(), used by the full_name and last_first expressions
+    full_name_sort  = Column(UnicodeText, admin_only=True, index=True)
+    last_first_sort = Column(UnicodeText, admin_only=True, index=True)
+
+    # maintained by _update_search_document(), see Session.QuerySubclass.fulltext()
+    search_text   = Column(UnicodeText, admin_only=True)
+    search_vector = Column(TSVector, nullable=True, admin_only=True)
+
     admin_account     = relationship('AdminAccount', backref=backref('user', load_on_pending=True), uselist=False)
 
     _repr_attr_names = ['full_name']
 
+    # properties copied (along with every column) into the snapshots which automated emails are rendered from
+    _email_snapshot_attrs = ['full_name', 'last_first']
+
+    _search_attrs = ['first_name', 'last_name', 'email', 'comments', 'admin_notes']
+    _trigram_attrs = ['first_name', 'last_name', 'email']
+
     @presave_adjustment
     def _misc_adjustments(self):
         if self.birthdate == '':
@@ -561,6 +702,35 @@ class User(MainModel):
             if value.isupper() or value.islower():
                 setattr(self, attr, value.title())
 
+    @presave_adjustment
+    def _update_sort_keys(self):
+        if not self.first_name:
+            self.full_name_sort = self.last_first_sort = 'zzz'
+        else:
+            self.full_name_sort = '{} {}'.format(self.first_name, self.last_name).lower()
+            self.last_first_sort = '{}, {}'.format(self.last_name, self.first_name).lower()
+
+    @presave_adjustment
+    def _update_normalized_columns(self):
+        self.normalized_email = self.normalize_email(self.email)
+        self.cellphone_digits = self.normalize_phone(self.cellphone)
+
+    @staticmethod
+    def normalize_email(email):
+        return (email or '').strip().lower()
+
+    @staticmethod
+    def normalize_phone(phone):
+        return re.sub(r'[^0-9]', '', phone or '')
+
+    @presave_adjustment
+    def _update_search_document(self):
+        search_text = ' '.join(getattr(self, attr) for attr in self._search_attrs if getattr(self, attr)).lower()
+        if search_text != self.search_text:
+            self.search_text = search_text
+            if Session.engine.dialect.name == 'postgresql':
+                self.search_vector = func.to_tsvector('simple', search_text)
+
     @property
     def address(self):
         if self.addresses:
@@ -579,9 +749,7 @@ class User(MainModel):
 
     @full_name.expression
     def full_name(cls):
-        return case([
-            (or_(cls.first_name == None, cls.first_name == ''), 'zzz')
-        ], else_=func.lower(cls.first_name + ' ' + cls.last_name))
+        return cls.full_name_sort
 
     @hybrid_property
     def last_first(self):
@@ -589,16 +757,23 @@ class User(MainModel):
 
     @last_first.expression
     def last_first(cls):
-        return case([
-            (or_(cls.first_name == None, cls.first_name == ''), 'zzz')
-        ], else_=func.lower(cls.last_name + ', ' + cls.first_name))
+        return cls.last_first_sort
+
 
+    @presave_adjustment
+    def _screen_watchlist(self):
+        if not sa.watchlist_index.loaded:
+            log.warning('not screening {} since the watchlist index has not been built', self.full_name)
+            return
+        try:
+            self.watchlist_guesses = ','.join(entry['id'] for entry in sa.watchlist_index.screen_user(self))
+        except:
+            log.error('unable to screen {} against the watchlist', self.full_name, exc_info=True)
 
     @property
     def watchlist_guess(self):
         try:
-            with Session() as session:
-                return [w.to_dict() for w in session.guess_attendee_watchentry(self)]
+            return sa.watchlist_index.lookup((self.watchlist_guesses or '').split(','))
         except:
             return None
 
@@ -694,7 +869,8 @@ class AdminAccount(MainModel):
         try:
             with Session() as session:
                 id = id or cherrypy.session['account_id']
-                return set(session.admin_account(id).access_ints)
+                [(access,)] = session.cached(session.query(AdminAccount.access).filter_by(id=id))
+                return {int(level) for level in access.split(',') if level}
         except:
             return set()
 
@@ -722,9 +898,32 @@ class Email(MainModel):
     subject = Column(UnicodeText)
     dest    = Column(UnicodeText)
     body    = Column(UnicodeText)
+    status  = Column(Choice(c.EMAIL_STATUS_OPTS), default=c.EMAIL_SENT)
+
+    # set for emails claimed by Session.claim_email(), as opposed to ones we sent by hand
+    automated = Column(Boolean, default=False)
+
+    # each automated email can only be sent to each model instance once (see Session.claim_email()), but we can
+    # send the same email by hand as many times as we like
+    __table_args__ = (
+        sqlalchemy.Index('ix_email_model_fk_id_ident', 'model', 'fk_id', 'ident'),
+        sqlalchemy.Index('ix_email_automated_claim', 'model', 'fk_id', 'ident', unique=True,
+                         postgresql_where=automated, sqlite_where=automated)
+    )
 
     _repr_attr_names = ['subject']
 
+    @hybrid_property
+    def claimable(self):
+        """Whether this email failed to send, or was claimed so long ago that whoever claimed it must have crashed."""
+        return self.status == c.EMAIL_FAILED or (
+            self.status == c.EMAIL_PENDING and self.when < datetime.now(UTC) - timedelta(seconds=c.EMAIL_CLAIM_TIMEOUT))
+
+    @claimable.expression
+    def claimable(cls):
+        return or_(cls.status == c.EMAIL_FAILED, and_(
+            cls.status == c.EMAIL_PENDING, cls.when < datetime.now(UTC) - timedelta(seconds=c.EMAIL_CLAIM_TIMEOUT)))
+
     @cached_property
     def fk(self):
         try:
@@ -785,6 +984,8 @@ class Tracking(MainModel):
     def differences(cls, instance):
         diff = {}
         for attr, column in instance.__table__.columns.items():
+            if isinstance(column.type, TSVector):
+                continue
             new_val = getattr(instance, attr)
             old_val = instance.orig_value_of(attr)
             if old_val != new_val:
@@ -820,7 +1021,8 @@ class Tracking(MainModel):
     @classmethod
     def track(cls, action, instance):
         if action in [c.CREATED]:
-            vals = {attr: cls.repr(column, getattr(instance, attr)) for attr, column in instance.__table__.columns.items()}
+            vals = {attr: cls.repr(column, getattr(instance, attr)) for attr, column in instance.__table__.columns.items()
+                    if not isinstance(column.type, TSVector)}
             data = cls.format(vals)
         elif action == c.UPDATED:
             diff = cls.differences(instance)
@@ -889,6 +1091,43 @@ def _make_getter(model):
             return inst
     return getter
 
+def _register_search_ddl(model):
+    """
+    Creates the indexes which back Session.QuerySubclass.fulltext() for the
+    given model whenever its table is created.  On Postgres that's a GIN index
+    on search_vector plus pg_trgm indexes on the model's _trigram_attrs.  On
+    SQLite we instead create an FTS5 table mirroring search_text, which is kept
+    up to date by triggers.
+    """
+    tablename = model.__tablename__
+    listen(model.__table__, 'before_create',
+           DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'))
+    listen(model.__table__, 'after_create',
+           DDL('CREATE INDEX ix_{0}_search_vector ON "{0}" USING gin (search_vector)'.format(tablename))
+               .execute_if(dialect='postgresql'))
+    for attr in model._trigram_attrs:
+        listen(model.__table__, 'after_create',
+               DDL('CREATE INDEX ix_{0}_{1}_trgm ON "{0}" USING gin ({1} gin_trgm_ops)'.format(tablename, attr))
+                   .execute_if(dialect='postgresql'))
+
+    for statement in [
+            'CREATE VIRTUAL TABLE {0}_search USING fts5(search_text, content=\'{0}\')',
+            'CREATE TRIGGER {0}_search_insert AFTER INSERT ON "{0}" BEGIN '
+            '  INSERT INTO {0}_search(rowid, search_text) VALUES (new.rowid, new.search_text); '
+            'END',
+            'CREATE TRIGGER {0}_search_delete AFTER DELETE ON "{0}" BEGIN '
+            '  INSERT INTO {0}_search({0}_search, rowid, search_text) VALUES (\'delete\', old.rowid, old.search_text); '
+            'END',
+            'CREATE TRIGGER {0}_search_update AFTER UPDATE OF search_text ON "{0}" BEGIN '
+            '  INSERT INTO {0}_search({0}_search, rowid, search_text) VALUES (\'delete\', old.rowid, old.search_text); '
+            '  INSERT INTO {0}_search(rowid, search_text) VALUES (new.rowid, new.search_text); '
+            'END']:
+        listen(model.__table__, 'after_create', DDL(statement.format(tablename)).execute_if(dialect='sqlite'))
+    listen(model.__table__, 'after_drop',
+           DDL('DROP TABLE IF EXISTS {0}_search'.format(tablename)).execute_if(dialect='sqlite'))
+_register_search_ddl(User)
+
+
 @swallow_exceptions
 def _presave_adjustments(session, context, instances='deprecated'):
     """
@@ -906,6 +1145,45 @@ def _track_changes(session, context, instances='deprecated'):
             if instance.__class__ not in Tracking.UNTRACKED:
                 Tracking.track(action, instance)
 
+@swallow_exceptions
+def _record_changed_tables(session, context, instances='deprecated'):
+    tables = session.info.setdefault('changed_tables', set())
+    for instance in chain(session.new, session.dirty, session.deleted):
+        tables.add(instance.__table__.name)
+
+@swallow_exceptions
+def _record_bulk_changed_table(context):
+    """
+    Query.update() and Query.delete() don't flush, so we record the table they
+    changed here.  Session.bulk_update_mappings() and friends and raw
+    session.execute() statements skip both this and our flush listeners, so
+    code which uses those on a cached table must call query_cache.invalidate()
+    itself.
+    """
+    context.session.info.setdefault('changed_tables', set()).add(context.query.model.__table__.name)
+
+@swallow_exceptions
+def _invalidate_query_cache(session):
+    tables = session.info.pop('changed_tables', None)
+    if tables:
+        sa.query_cache.invalidate(tables)
+
+def _discard_changed_tables(session):
+    session.info.pop('changed_tables', None)
+
+@swallow_exceptions
+def _record_counter_changes(session, context, instances='deprecated'):
+    sa.counters.record(session)
+
+@swallow_exceptions
+def _apply_counter_changes(session):
+    deltas = session.info.pop('counter_deltas', None)
+    if deltas:
+        sa.counters.apply(deltas)
+
+def _discard_counter_changes(session):
+    session.info.pop('counter_deltas', None)
+
 def register_session_listeners():
     """
     NOTE 1: IMPORTANT!!! Because we are locking our c.BADGE_LOCK at the start of this, all of these functions MUST NOT
@@ -919,6 +1197,14 @@ def register_session_listeners():
     """
     listen(Session.session_factory, 'before_flush', _presave_adjustments)
     listen(Session.session_factory, 'before_flush', _track_changes)
+    listen(Session.session_factory, 'before_flush', _record_changed_tables)
+    listen(Session.session_factory, 'before_flush', _record_counter_changes)
+    listen(Session.session_factory, 'after_bulk_update', _record_bulk_changed_table)
+    listen(Session.session_factory, 'after_bulk_delete', _record_bulk_changed_table)
+    listen(Session.session_factory, 'after_commit', _invalidate_query_cache)
+    listen(Session.session_factory, 'after_commit', _apply_counter_changes)
+    listen(Session.session_factory, 'after_rollback', _discard_changed_tables)
+    listen(Session.session_factory, 'after_rollback', _discard_counter_changes)
 register_session_listeners()
 
 
@@ -0,0 +1,305 @@
+import queue
+import smtplib
+from email.mime.text import MIMEText
+from email.utils import formatdate, make_msgid
+
+from darecms.common import *
+from darecms.utils import _record_email_sent
+
+
+class OutgoingEmail:
+    """One email waiting in our outbox, along with the Email row to save once it's actually been sent."""
+
+    def __init__(self, source, to, cc, bcc, subject, body, format='text', record=None, claim_id=None):
+        self.source, self.to, self.cc, self.bcc = source, to, cc, bcc
+        self.subject, self.body, self.format = subject, body, format
+        self.record, self.claim_id = record, claim_id
+        self.attempts = 0
+
+    @property
+    def recipients(self):
+        return self.to + self.cc + self.bcc
+
+    def as_mime(self):
+        message = MIMEText(self.body, 'plain' if self.format == 'text' else 'html', 'utf-8')
+        message['Subject'] = self.subject
+        message['From'] = self.source
+        message['To'] = ', '.join(self.to)
+        if self.cc:
+            message['Cc'] = ', '.join(self.cc)
+        message['Date'] = formatdate(localtime=True)
+        message['Message-ID'] = make_msgid()
+        return message
+
+
+class EmailTransport:
+    """
+    Base class for the ways we can actually deliver an email, selected with
+    the email_transport config option.  Each outbox worker thread gets its own
+    transport, which keeps its connection open between emails.
+    """
+
+    def send(self, email):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class SESTransport(EmailTransport):
+    """Sends through Amazon SES, reusing one client for every email sent by this worker."""
+
+    def __init__(self):
+        from amazon_ses import AmazonSES
+        self.client = AmazonSES(c.AWS_ACCESS_KEY, c.AWS_SECRET_KEY)
+
+    def send(self, email):
+        from amazon_ses import EmailMessage
+        message = EmailMessage(subject=email.subject, **{'bodyText' if email.format == 'text' else 'bodyHtml': email.body})
+        self.client.sendEmail(
+            source=email.source,
+            toAddresses=email.to,
+            ccAddresses=email.cc,
+            bccAddresses=email.bcc,
+            message=message)
+
+
+class SMTPTransport(EmailTransport):
+    """
+    Sends through an SMTP server, e.g. a local relay or a sink such as
+    "python -m smtpd -n -c DebuggingServer localhost:1025" for benchmarking.
+    """
+
+    def __init__(self):
+        self.connection = None
+
+    def _connect(self):
+        self.connection = smtplib.SMTP(c.EMAIL_SMTP_HOST, c.EMAIL_SMTP_PORT, timeout=30)
+        if c.EMAIL_SMTP_USERNAME:
+            self.connection.starttls()
+            self.connection.login(c.EMAIL_SMTP_USERNAME, c.EMAIL_SMTP_PASSWORD)
+
+    def send(self, email):
+        if self.connection is None:
+            self._connect()
+        try:
+            self.connection.send_message(email.as_mime(), email.source, email.recipients)
+        except smtplib.SMTPServerDisconnected:
+            self.connection = None
+            raise
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.quit()
+            except smtplib.SMTPException:
+                pass
+            self.connection = None
+
+
+class FileTransport(EmailTransport):
+    """Writes each email to its own .eml file in c.EMAIL_FILE_DIR instead of sending it; useful for development and benchmarking."""
+
+    def __init__(self, dirname=None):
+        self.dirname = dirname or c.EMAIL_FILE_DIR
+        os.makedirs(self.dirname, exist_ok=True)
+
+    def send(self, email):
+        with open(join(self.dirname, '{}.eml'.format(uuid4())), 'w') as f:
+            f.write(email.as_mime().as_string())
+
+
+email_transports = {
+    'ses': SESTransport,
+    'smtp': SMTPTransport,
+    'file': FileTransport
+}
+
+
+class TokenBucket:
+    """
+    Limits how many emails we send per second across all of our worker
+    threads, so that we stay within our email provider's sending quota.  Up
+    to `capacity` emails can go out at once after a quiet period, after which
+    we send at a steady `rate` per second.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate, self.capacity = rate, capacity
+        self.tokens = capacity
+        self.updated = perf_counter()
+        self.lock = RLock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = perf_counter()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            sleep(wait)
+
+
+class Outbox:
+    """
+    Queue of emails waiting to be sent, drained by a pool of worker threads
+    (c.EMAIL_WORKERS of them) so that whoever calls send_email() doesn't have
+    to wait for our email provider.  Workers are started the first time we
+    queue an email, and each keeps its own transport connection open.
+
+    Sending is rate limited with a TokenBucket, and emails which fail are
+    retried with exponential backoff up to c.EMAIL_MAX_RETRIES times before
+    we give up and log the failure.  The Email row recording that an email
+    was sent is only saved once it's actually been delivered.  Emails which
+    were claimed ahead of time with Session.claim_email() already have a
+    pending Email row, so we instead collect whether each one was sent or
+    failed and update their statuses in batches.
+
+    Worker threads only make sense while the server is running.  Emails
+    queued from anywhere else (e.g. sep commands and other scripts) are sent
+    right away on the calling thread instead, and whatever is still queued
+    when the server stops is sent before it exits; see drain().
+
+    Pass a transport factory to override the email_transport config option,
+    e.g. to benchmark against a FileTransport.
+    """
+
+    def __init__(self, transport=None):
+        self.transport = transport
+        self.queue = queue.Queue()
+        self.lock = RLock()
+        self.workers = []
+        self.bucket = None
+        self.sent = self.failed = 0
+        self.statuses = defaultdict(list)
+
+    def _ensure_bucket(self):
+        with self.lock:
+            if not self.bucket:
+                self.bucket = TokenBucket(c.EMAIL_RATE_LIMIT, c.EMAIL_RATE_BURST)
+
+    def _ensure_workers(self):
+        self._ensure_bucket()
+        with self.lock:
+            if not self.workers:
+                for i in range(c.EMAIL_WORKERS):
+                    worker = Thread(target=self._work, name='email outbox {}'.format(i + 1), daemon=True)
+                    worker.start()
+                    self.workers.append(worker)
+
+    def put(self, email):
+        if cherrypy.engine.state == cherrypy.engine.states.STARTED:
+            self._ensure_workers()
+            self.queue.put(email)
+        else:
+            self._send_now([email])
+
+    def drain(self):
+        """Sends every email still in our queue on this thread, e.g. when the server is stopping."""
+        emails = []
+        while True:
+            try:
+                emails.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+
+        try:
+            self._send_now(emails)
+        finally:
+            for email in emails:
+                self.queue.task_done()
+
+    def _send_now(self, emails):
+        if emails:
+            self._ensure_bucket()
+            transport = (self.transport or email_transports[c.EMAIL_TRANSPORT])()
+            try:
+                for email in emails:
+                    self._deliver(transport, email)
+            finally:
+                transport.close()
+        self.flush_statuses()
+
+    def flush(self):
+        """Blocks until every email we've queued so far has either been sent or given up on."""
+        self.queue.join()
+        self.flush_statuses()
+
+    def record_status(self, claim_id, status):
+        """Marks a claimed Email row as sent or failed, saving these updates in batches of c.EMAIL_STATUS_BATCH_SIZE."""
+        with self.lock:
+            self.statuses[status].append(claim_id)
+            full = sum(map(len, self.statuses.values())) >= c.EMAIL_STATUS_BATCH_SIZE
+        if full:
+            self.flush_statuses()
+
+    def flush_statuses(self):
+        with self.lock:
+            statuses, self.statuses = self.statuses, defaultdict(list)
+        if statuses:
+            with Session() as session:
+                for status, ids in statuses.items():
+                    session.query(Email).filter(Email.id.in_(ids)).update({Email.status: status}, synchronize_session=False)
+
+    def _work(self):
+        try:
+            transport = (self.transport or email_transports[c.EMAIL_TRANSPORT])()
+        except Exception:
+            log.error('unable to set up {} email transport, so this outbox worker is exiting', c.EMAIL_TRANSPORT, exc_info=True)
+            return
+
+        try:
+            while not stopped.is_set():
+                try:
+                    email = self.queue.get(timeout=1)
+                except queue.Empty:
+                    self.flush_statuses()
+                    continue
+
+                try:
+                    self._deliver(transport, email)
+                finally:
+                    self.queue.task_done()
+        finally:
+            transport.close()
+
+    def _deliver(self, transport, email):
+        while True:
+            self.bucket.acquire()
+            email.attempts += 1
+            try:
+                transport.send(email)
+            except Exception:
+                if email.attempts > c.EMAIL_MAX_RETRIES:
+                    with self.lock:
+                        self.failed += 1
+                    log.error('giving up on sending {!r} to {} after {} attempts',
+                              email.subject, email.to, email.attempts, exc_info=True)
+                    if email.claim_id:
+                        self.record_status(email.claim_id, c.EMAIL_FAILED)
+                    return
+                backoff = c.EMAIL_RETRY_BACKOFF * 2 ** (email.attempts - 1)
+                log.warning('error sending {!r} to {}, retrying in {}s', email.subject, email.to, backoff, exc_info=True)
+                sleep(backoff)
+            else:
+                with self.lock:
+                    self.sent += 1
+                if email.claim_id:
+                    self.record_status(email.claim_id, c.EMAIL_SENT)
+                elif email.record is not None:
+                    _record_email_sent(email.record)
+                return
+
+    def stats(self):
+        return {
+            'queued': self.queue.qsize(),
+            'workers': len(self.workers),
+            'sent': self.sent,
+            'failed': self.failed
+        }
+
+outbox = Outbox()
+cherrypy.engine.subscribe('stop', outbox.drain)
@@ -0,0 +1,149 @@
+from darecms.common import *
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.sql.util import find_tables
+
+
+class QueryCacheRegion:
+    """
+    One named, size-limited LRU cache of query results.  Each cached result
+    remembers which tables its query read from so that we can throw it away
+    as soon as any of those tables is written to.  Results also expire after
+    the region's ttl, since writes made by other processes don't reach us.
+    """
+
+    def __init__(self, name, max_size, ttl):
+        self.name, self.max_size, self.ttl = name, max_size, ttl
+        self.lock = RLock()
+        self.entries = OrderedDict()
+        self.hits = self.misses = self.invalidations = 0
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry['expires'] > datetime.now().timestamp():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry['result']
+            self.entries.pop(key, None)
+            self.misses += 1
+
+    def set(self, key, result, tables, ttl=None):
+        with self.lock:
+            self.entries[key] = {
+                'result': result,
+                'tables': tables,
+                'expires': datetime.now().timestamp() + (self.ttl if ttl is None else ttl)
+            }
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, tables=None):
+        with self.lock:
+            for key, entry in list(self.entries.items()):
+                if tables is None or not entry['tables'].isdisjoint(tables):
+                    del self.entries[key]
+                    self.invalidations += 1
+
+    def stats(self):
+        return {
+            'size': len(self.entries),
+            'max_size': self.max_size,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hit_rate,
+            'invalidations': self.invalidations
+        }
+
+
+class QueryCache:
+    """
+    Process-wide cache of query results for small, hot, rarely-changing tables
+    such as AdminAccount and ApprovedEmail.  Use this through Session.cached():
+
+        with Session() as session:
+            idents = session.cached(session.query(ApprovedEmail.ident), region='reference')
+
+    Regions are configured in the [query_cache] section of our config.  Cached
+    rows are invalidated whenever a session commits changes to one of the
+    tables they were read from, including through Query.update() and
+    Query.delete(); see the session listeners in darecms.models.  Writes made
+    with Session.bulk_update_mappings() (and the other bulk_* methods) or raw
+    session.execute() statements aren't seen by those listeners, so code that
+    uses them on a cached table needs to call query_cache.invalidate().  Each
+    server process keeps its own cache; see the debug/query_cache page.
+    """
+
+    def __init__(self):
+        self.lock = RLock()
+        self.regions = {}
+
+    def region(self, name):
+        with self.lock:
+            if name not in self.regions:
+                conf = c.QUERY_CACHE.get(name) or c.QUERY_CACHE['default']
+                self.regions[name] = QueryCacheRegion(name, conf['max_size'], conf['ttl'])
+            return self.regions[name]
+
+    @staticmethod
+    def key_for(query):
+        statement = query.statement
+        compiled = statement.compile()
+        return str(compiled) + repr(sorted(compiled.params.items()))
+
+    @staticmethod
+    def tables_for(query):
+        return frozenset(table.name for table in find_tables(query.statement, include_joins=True, include_aliases=True)
+                         if hasattr(table, 'name'))
+
+    def get(self, session, query, region='reference'):
+        region = self.region(region)
+        key = self.key_for(query)
+        result = region.get(key)
+        if result is None:
+            result = query.all()
+            region.set(key, [self._detached_copy(row) for row in result], self.tables_for(query))
+            return result
+        else:
+            return [session.merge(row, load=False) if self._is_mapped(row) else row for row in result]
+
+    def invalidate(self, tables=None):
+        with self.lock:
+            regions = list(self.regions.values())
+        for region in regions:
+            region.invalidate(tables)
+
+    def stats(self):
+        with self.lock:
+            return {name: region.stats() for name, region in self.regions.items()}
+
+    @staticmethod
+    def _is_mapped(row):
+        return isinstance(row, MainModel)
+
+    @classmethod
+    def _detached_copy(cls, row):
+        """
+        Model instances belong to the session which loaded them, so we cache a
+        detached copy of their column values instead, which is merged into the
+        requesting session on each cache hit.  Column-only rows are immutable
+        and are cached as-is.
+        """
+        if not cls._is_mapped(row):
+            return row
+
+        mapper = sqlalchemy.inspect(row).mapper
+        copy = mapper.class_manager.new_instance()
+        for attr in mapper.column_attrs:
+            set_committed_value(copy, attr.key, getattr(row, attr.key))
+        make_transient_to_detached(copy)
+        return copy
+
+query_cache = QueryCache()
@@ -98,6 +98,162 @@ def print_config():
     pprint(_config.dict())
 
 
+@entry_point
+def reload_server_config(*pids):
+    """
+    check that our config files still parse, then tell each of the given server processes to reload their config
+    without restarting, e.g.
+
+        sep reload_server_config $(pgrep -f run_server)
+    """
+    reload_config()
+    print('Config files parsed successfully')
+    for pid in pids:
+        os.kill(int(pid), signal.SIGUSR2)
+        print('Signaled process {}'.format(pid))
+
+
+@entry_point
+def benchmark_config(*names):
+    """
+    print the per-access cost of looking up config values through the c object, comparing the cached getters
+    used by Config.__getattr__ against re-resolving each name on every access (which is what we used to do), e.g.
+
+        sep benchmark_config EVENT_NAME SQLALCHEMY_URL HAS_ACCOUNTS_ACCESS
+    """
+    from timeit import timeit
+    from darecms.config import _getters
+
+    iterations = 100000
+    for name in names or ['EVENT_NAME', 'ORGANIZATION_NAME', 'SQLALCHEMY_URL', 'DEV_BOX']:
+        getattr(c, name)
+        if name not in _getters:
+            print('{:<30} set directly on c, so it never goes through Config.__getattr__'.format(name))
+            continue
+
+        uncached = timeit(lambda: c._resolve(name)(), number=iterations)
+        cached = timeit(lambda: _getters[name](), number=iterations)
+        direct = timeit(lambda: getattr(c, name), number=iterations)
+        print('{:<30} resolved each time: {:>7.3f}us  cached getter: {:>7.3f}us  c.{}: {:.3f}us'.format(
+            name, 1e6 * uncached / iterations, 1e6 * cached / iterations, name, 1e6 * direct / iterations))
+
+
+@entry_point
+def compile_templates():
+    """
+    compile all of our templates (including plugin template overrides) into the on-disk bytecode cache so that
+    server processes don't have to compile them on first use; run this after each deploy
+    """
+    compiled, errors = JinjaEnv.compile_templates()
+    for name, error in sorted(errors.items()):
+        print('Could not compile {}: {}'.format(name, error))
+    print('Compiled {} templates into the bytecode cache'.format(compiled))
+
+
+@entry_point
+def build_assets():
+    """
+    fingerprint all of our static files (including plugin overrides) and write out our asset bundles and manifest,
+    so that server processes don't each need to do this on startup; run this after each deploy
+    """
+    manifest = asset_manifest.build()
+    print('Fingerprinted {} static files into {}'.format(len(manifest['files']), asset_manifest.manifest_path))
+
+
+@entry_point
+def benchmark_outbox(count='1000'):
+    """
+    queue this many test emails through a separate email outbox which writes them to .eml files in a temporary
+    directory, and print how quickly they were sent; this uses our email_workers and rate limit settings, so it
+    shows the throughput we'd get from a real email provider which could keep up
+    """
+    from tempfile import TemporaryDirectory
+    with TemporaryDirectory() as dirname:
+        bench = Outbox(transport=lambda: FileTransport(dirname))
+        started = perf_counter()
+        for i in range(int(count)):
+            bench.put(OutgoingEmail(c.ADMIN_EMAIL, ['test{}@mailinator.com'.format(i)], [], [],
+                                    'Outbox benchmark #{}'.format(i), 'This is a test email.'))
+        bench.flush()
+        elapsed = perf_counter() - started
+        print('Sent {} emails with {} workers in {:.2f}s ({:.1f} emails/second with a rate limit of {})'.format(
+            bench.sent, c.EMAIL_WORKERS, elapsed, bench.sent / elapsed, c.EMAIL_RATE_LIMIT))
+
+
+@entry_point
+def benchmark_email_rendering(ident, count='1000'):
+    """
+    render the automated email with the given ident for up to this many of its model's rows, first one at a time
+    on this thread and then on a pool of email_render_processes worker processes, and print the throughput of each
+    (this ignores the email's filters, and doesn't send or record anything), e.g.
+
+        sep benchmark_email_rendering "Your registration has been confirmed" 5000
+    """
+    email_category = AutomatedEmail.instances[ident]
+    with Session() as session:
+        recipients = AutomatedEmail.queries[email_category.model](session).limit(int(count)).all()
+        if not recipients:
+            print('There are no {} rows to render this email for'.format(email_category.model.__name__))
+            return
+
+        started = perf_counter()
+        for model_instance in recipients:
+            email_category.render(model_instance)
+        inline = perf_counter() - started
+
+        started = perf_counter()
+        with EmailRenderer() as renderer:
+            rendered = [pair for batch in renderer.render_batches(email_category, recipients) for pair in batch]
+        pooled = perf_counter() - started
+
+    unrendered = len([body for model_instance, body in rendered if body is None])
+    print('Rendered {} emails on this thread in {:.2f}s ({:.1f} emails/second)'.format(
+        len(recipients), inline, len(recipients) / inline))
+    print('Rendered {} emails on {} processes in batches of {} in {:.2f}s ({:.1f} emails/second, including startup)'.format(
+        len(rendered), renderer.processes, renderer.batch_size, pooled, len(rendered) / pooled))
+    if unrendered:
+        print('{} emails could not be rendered from snapshots and would be rendered on the daemon thread'.format(unrendered))
+
+
+@entry_point
+def email_daemon_runs(count='10'):
+    """
+    print the metrics from the email daemon's most recent runs, and each email category's totals across those runs
+    with the slowest categories first, to show which categories and filters are making the daemon slow
+    """
+    from darecms.automated_emails import email_daemon_runs as runs
+    recent = runs.recent()[:int(count)]
+    for run in recent:
+        print('{started}: sent {sent} emails in {seconds:.2f}s, outbox queue {queue_depth[start]} -> {queue_depth[end]}'.format(**run))
+
+    print()
+    for ident, totals in runs.category_totals(recent):
+        print(ident)
+        print('    {} candidates, {} sent, skipped: {}'.format(totals['candidates'], totals['sent'], dict(totals['skipped'])))
+        print('    ' + ', '.join('{} {:.2f}s'.format(stage, seconds) for stage, seconds in sorted(totals['seconds'].items())))
+
+
+@entry_point
+def estimate_emails(*idents):
+    """
+    print how many emails each automated email category (or just the ones with the given idents) would send if it
+    were approved and its date filters allowed it right now, along with a few sample recipients; nothing is rendered
+    or sent, so this is safe to run before approving a category, e.g.
+
+        sep estimate_emails "Your registration has been confirmed"
+    """
+    for ident, estimate in SendAllAutomatedEmailsJob.dry_run(idents).items():
+        print(ident)
+        print('    {} {} emails from {} candidates{}{}'.format(
+            'exactly' if estimate['exact'] else 'about', estimate['estimated'], estimate['candidates'],
+            '' if estimate['exact'] else ' (extrapolated from a sample of {})'.format(estimate['sampled']),
+            '' if estimate['approved'] else ', not yet approved'))
+        if estimate['closed']:
+            print('    not sending right now: {}'.format(estimate['closed']))
+        for id, email in estimate['sample']:
+            print('    e.g. {} ({})'.format(email, id))
+
+
 @entry_point
 def insert_admin():
     with Session() as session:
@@ -107,6 +263,15 @@ def insert_admin():
             print("Not allowed to create admin account at this time")
 
 
+@entry_point
+def screen_watchlist():
+    """
+    re-screen every user against the active watchlist entries and save any
+    possible matches, e.g. after importing a batch of users or watchlist entries
+    """
+    print('Updated watchlist guesses for {} users'.format(screen_all_users()))
+
+
 @entry_point
 def drop_db():
     assert c.DEV_BOX, 'drop_uber_db is only available on development boxes'
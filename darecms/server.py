@@ -1,4 +1,6 @@
 from darecms.common import *
+import gzip
+import jinja2.meta
 
 mimetypes.init()
 
@@ -38,33 +40,153 @@ cherrypy.tools.custom_verbose_logger = cherrypy.Tool('before_error_response', lo
 
 
 class StaticViews:
+    """
+    Serves templates from our "static_views" template directory, which are
+    mostly Javascript and CSS files that use a few of our config values.  These
+    don't change between requests, so we keep each rendered file in memory
+    (along with a gzipped copy) until the template or any template it extends
+    or includes is modified.
+
+    Each rendered file gets a fingerprint of its contents, which we use as its
+    ETag.  Links generated with the static_view_url() template function
+    include this fingerprint as their "v" parameter, so browsers can cache
+    those responses forever; a new fingerprint (and thus a new URL) is
+    generated whenever the file changes.  Since our config values can also
+    change when a deadline passes, we clear the whole cache when that happens.
+
+    Files are cached by template name alone, so static views must not use
+    config values which differ between requests, such as c.CSRF_TOKEN,
+    c.ADMIN_ACCESS_SET, or the c.HAS_*_ACCESS flags.
+    """
+    cache = {}  # template name -> dict of rendered content and the template mtimes it was rendered from
+    cache_lock = RLock()
+
     def path_args_to_string(self, path_args):
         return '/'.join(path_args)
 
     def get_full_path_from_path_args(self, path_args):
         return 'static_views/' + self.path_args_to_string(path_args)
 
-    def get_filename_from_path_args(self, path_args):
-        return path_args[-1]
+    @classmethod
+    def template_files(cls, env, template_name, found=None):
+        """Returns the filenames of a template and every template it extends, includes, or imports."""
+        found = set() if found is None else found
+        template = env.get_template(template_name)
+        if template.filename not in found:
+            found.add(template.filename)
+            source = env.loader.get_source(env, template_name)[0]
+            for referenced in jinja2.meta.find_referenced_templates(env.parse(source)):
+                if referenced:  # dynamically chosen templates show up as None, and we can't follow those
+                    cls.template_files(env, referenced, found)
+        return found
+
+    @classmethod
+    def is_fresh(cls, rendered):
+        try:
+            return all(os.stat(filename).st_mtime == mtime for filename, mtime in rendered['mtimes'].items())
+        except OSError:
+            return False
+
+    @classmethod
+    def get_rendered(cls, template_name):
+        with cls.cache_lock:
+            rendered = cls.cache.get(template_name)
+        if rendered and cls.is_fresh(rendered):
+            return rendered
+
+        env = JinjaEnv.env()
+        mtimes = {filename: os.stat(filename).st_mtime for filename in cls.template_files(env, template_name)}
+        body = render(template_name)
+        rendered = {
+            'mtimes': mtimes,
+            'body': body,
+            'gzipped': gzip.compress(body),
+            'fingerprint': sha512(body).hexdigest()[:16],
+            'content_type': mimetypes.guess_type(template_name)[0] or 'application/octet-stream'
+        }
+        with cls.cache_lock:
+            cls.cache[template_name] = rendered
+        return rendered
+
+    @staticmethod
+    def accepts_gzip(accept_encoding):
+        """
+        Returns whether an Accept-Encoding header allows a gzipped response,
+        honoring quality values, e.g. "gzip;q=0" or "*;q=0" turn gzip off.
+        """
+        qualities = {}
+        for coding in accept_encoding.split(','):
+            name, *params = [part.strip() for part in coding.split(';')]
+            quality = 1.0
+            for param in params:
+                key, _, value = param.partition('=')
+                if key.strip().lower() == 'q':
+                    try:
+                        quality = float(value)
+                    except ValueError:
+                        quality = 0.0
+            if name:
+                qualities[name.lower()] = quality
+
+        for name in ['gzip', 'x-gzip', '*']:
+            if name in qualities:
+                return qualities[name] > 0
+        return False
+
+    @classmethod
+    def clear_cache(cls):
+        with cls.cache_lock:
+            cls.cache.clear()
 
     @cherrypy.expose
-    def default(self, *path_args, **kwargs):
-        content_filename = self.get_filename_from_path_args(path_args)
-
+    def default(self, *path_args, v=None, **kwargs):
         template_name = self.get_full_path_from_path_args(path_args)
         try:
-            content = render(template_name)
+            rendered = self.get_rendered(template_name)
         except jinja2.exceptions.TemplateNotFound as e:
             raise cherrypy.HTTPError(404, "Couldn't find {}".format(template_name)) from e
 
-        guessed_content_type = mimetypes.guess_type(content_filename)[0]
-        return cherrypy.lib.static.serve_fileobj(content, name=content_filename, content_type=guessed_content_type)
+        headers = cherrypy.response.headers
+        headers['Content-Type'] = rendered['content_type']
+        headers['ETag'] = '"{}"'.format(rendered['fingerprint'])
+        headers['Vary'] = 'Accept-Encoding'
+        if v == rendered['fingerprint']:
+            headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+        else:
+            headers['Cache-Control'] = 'public, max-age=0, must-revalidate'
+
+        if cherrypy.request.headers.get('If-None-Match') == headers['ETag']:
+            cherrypy.response.status = 304
+            return b''
+
+        if self.accepts_gzip(cherrypy.request.headers.get('Accept-Encoding', '')):
+            headers['Content-Encoding'] = 'gzip'
+            body = rendered['gzipped']
+        else:
+            body = rendered['body']
+        headers['Content-Length'] = len(body)
+        return body
+
+on_config_reload(StaticViews.clear_cache)
+deadlines.on_flip(StaticViews.clear_cache)
+
+
+@JinjaEnv.jinja_export
+def static_view_url(path):
+    """
+    Returns the fingerprinted URL of one of our static_views templates, e.g.
+    {{ static_view_url('js/config.js') }}, which browsers may cache forever.
+    """
+    rendered = StaticViews.get_rendered('static_views/' + path)
+    return '{}/static_views/{}?v={}'.format(c.PATH, path, rendered['fingerprint'])
+
 
 @all_renderable()
 class Root:
     def index(self):
         raise HTTPRedirect('common/')
 
+    static = StaticFiles()
     static_views = StaticViews()
 
 mount_site_sections(c.MODULE_ROOT)
@@ -72,7 +194,20 @@ mount_site_sections(c.MODULE_ROOT)
 cherrypy.tree.mount(Root(), c.PATH, c.APPCONF)
 static_overrides(join(c.MODULE_ROOT, 'static'))
 
-# DaemonTask(SendAllAutomatedEmailsJob.send_all_emails, interval=300,   name="send emails")
+# every request is profiled when c.TEMPLATE_PROFILING is on; see RenderProfile and the debug/render_profiles page
+cherrypy.engine.subscribe('before_request', RenderProfile.start)
+cherrypy.engine.subscribe('after_request', lambda: RenderProfile.finish(cherrypy.request.path_info))
+
+
+def _handle_reload_signal():
+    """
+    "sep reload_server_config PID" sends SIGUSR2 to ask a running server to re-read its config files.  Signal
+    handlers can only be installed from the main thread, so we do this when the engine starts.
+    """
+    cherrypy.engine.signal_handler.set_handler('SIGUSR2', reload_config)
+
+if getattr(cherrypy.engine, 'signal_handler', None):
+    cherrypy.engine.subscribe('start', _handle_reload_signal)
 
 # TODO: this should be replaced by something a little cleaner, but it can be a useful debugging tool
 # DaemonTask(lambda: log.error(Session.engine.pool.status()), interval=5)
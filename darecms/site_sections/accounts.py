@@ -46,6 +46,7 @@ class Root:
         session.delete(session.user(id))
         raise HTTPRedirect('{}?message={}', return_to if return_to else 'index', 'Account deleted')
 
+    @streamed
     @site_mappable
     def all(self, session, message='', page='0', search_text='', uploaded_id='', order='last_first', invalid='', **params):
         # DEVELOPMENT ONLY: it's an extremely convenient shortcut to show the first page
@@ -0,0 +1,17 @@
+from darecms.common import *
+
+
+@all_renderable(c.ACCOUNTS)
+class Root:
+    def render_profiles(self, message=''):
+        return {
+            'message': message,
+            'enabled': c.TEMPLATE_PROFILING,
+            'profiles': [profile.to_dict() for profile in list(RenderProfile.recent)]
+        }
+
+    def query_cache(self, message=''):
+        return {
+            'message': message,
+            'regions': sorted(query_cache.stats().items())
+        }
@@ -0,0 +1,13 @@
+from darecms.common import *
+
+
+@all_renderable(c.ACCOUNTS)
+class Root:
+    def daemon_runs(self, message=''):
+        runs = email_daemon_runs.recent()
+        return {
+            'message': message,
+            'runs': runs,
+            'category_totals': email_daemon_runs.category_totals(runs),
+            'outbox': outbox.stats()
+        }
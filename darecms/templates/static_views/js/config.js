@@ -0,0 +1,8 @@
+// Config values shared by our page scripts.  This file is cached by StaticViews, so it must only use values which
+// are the same for every request; anything specific to the current admin (e.g. c.CSRF_TOKEN) belongs in the page.
+var darecms = {
+    path: {{ c.PATH|tojson }},
+    urlBase: {{ c.URL_BASE|tojson }},
+    eventName: {{ c.EVENT_NAME|tojson }},
+    siteName: {{ c.SITE_NAME|tojson }}
+};
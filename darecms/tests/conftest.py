@@ -0,0 +1,45 @@
+import pytest
+
+from darecms.common import *
+
+
+@pytest.fixture(scope='session')
+def db():
+    Session.initialize_db(modify_tables=True, drop=True)
+    watchlist_index.refresh()
+
+
+@pytest.fixture
+def users(db):
+    with Session() as session:
+        session.add_all([
+            User(first_name='Ada', last_name='Lovelace', email='ada@example.com', verified=True),
+            User(first_name='Grace', last_name='Hopper', email='grace@example.com', verified=False),
+            User(first_name='Alan', last_name='Turing', email='', verified=True)
+        ])
+
+    yield
+
+    with Session() as session:
+        session.query(Email).delete(synchronize_session=False)
+        session.query(User).delete(synchronize_session=False)
+
+
+@pytest.fixture
+def email_category(monkeypatch):
+    """
+    Registers a test email category, rendering an existing template which refers to its model as "attendee".  Tests
+    which want a different filter can register their own categories with register_category().
+    """
+    monkeypatch.setattr(User, 'email_model_name', 'attendee', raising=False)
+    registered = []
+
+    def register_category(ident, filter=lambda user: True, **kwargs):
+        registered.append(ident)
+        return AutomatedEmail(User, 'Test email', 'reg_workflow/prereg_check.txt', filter, ident,
+                              needs_approval=False, **kwargs)
+
+    yield register_category
+
+    for ident in registered:
+        AutomatedEmail.instances.pop(ident, None)
@@ -0,0 +1,114 @@
+from darecms.common import *
+
+
+def test_benchmark_email_rendering(users, email_category, capsys):
+    email_category('test_benchmark')
+    sep_commands.benchmark_email_rendering('test_benchmark', '10')
+    output = capsys.readouterr().out
+    assert 'Rendered 3 emails on this thread' in output
+    assert 'Rendered 3 emails on {} processes'.format(c.EMAIL_RENDER_PROCESSES) in output
+
+
+def test_render_batches_match_inline_rendering(users, email_category):
+    category = email_category('test_render_batches')
+    with Session() as session:
+        recipients = session.query(User).order_by(User.first_name).all()
+        with EmailRenderer(processes=2, batch_size=2) as renderer:
+            rendered = [pair for batch in renderer.render_batches(category, recipients) for pair in batch]
+        assert [model_instance for model_instance, body in rendered] == recipients
+        assert [body for model_instance, body in rendered] == [category.render(user) for user in recipients]
+
+
+def test_dry_run_with_python_filter(users, email_category):
+    email_category('test_python_filter', lambda user: user.verified)
+    estimate = SendAllAutomatedEmailsJob.dry_run(['test_python_filter'])['test_python_filter']
+    assert estimate['candidates'] == 2  # users without an email address are never candidates
+    assert estimate['sampled'] == 2
+    assert estimate['estimated'] == 1
+    assert estimate['exact']
+    assert [email for id, email in estimate['sample']] == ['ada@example.com']
+
+
+def test_dry_run_extrapolates_from_sample(users, email_category):
+    email_category('test_sampled', lambda user: True)
+    estimate = SendAllAutomatedEmailsJob.dry_run(['test_sampled'], sample_size=1)['test_sampled']
+    assert estimate['candidates'] == 2
+    assert estimate['sampled'] == 1
+    assert estimate['estimated'] == 2
+    assert not estimate['exact']
+
+
+def test_dry_run_without_python_filter(users, email_category):
+    email_category('test_sql_filter', None, sql_filter=lambda: User.verified == True)
+    estimate = SendAllAutomatedEmailsJob.dry_run(['test_sql_filter'])['test_sql_filter']
+    assert estimate['candidates'] == estimate['estimated'] == 1
+    assert estimate['sampled'] == 0
+    assert estimate['exact']
+    assert [email for id, email in estimate['sample']] == ['ada@example.com']
+
+
+def test_dry_run_skips_emails_already_sent(users, email_category):
+    category = email_category('test_already_sent', None, sql_filter=lambda: User.verified == True)
+    with Session() as session:
+        ada = session.query(User).filter_by(email='ada@example.com').one()
+        category.send_claimed(session, ada)
+    assert SendAllAutomatedEmailsJob.dry_run(['test_already_sent'])['test_already_sent']['candidates'] == 0
+
+
+def test_estimate_emails(users, email_category, capsys):
+    email_category('test_estimate', lambda user: user.verified)
+    sep_commands.estimate_emails('test_estimate')
+    assert 'exactly 1 emails from 2 candidates' in capsys.readouterr().out
+
+
+def test_daemon_runs_are_saved_for_other_processes(monkeypatch, tmpdir):
+    filename = str(tmpdir.join('data', 'email_daemon_runs.json'))
+    monkeypatch.setattr(EmailDaemonRuns, 'filename', filename)
+    run = EmailDaemonRun()
+    run.category('test_metrics')['sent'] += 1
+    EmailDaemonRuns().record(run)
+
+    assert tmpdir.join('data').listdir() == [tmpdir.join('data', 'email_daemon_runs.json')]
+    [saved] = EmailDaemonRuns().recent()
+    assert saved['sent'] == 1
+
+
+def test_claim_email_only_once(users):
+    with Session() as session:
+        ada = session.query(User).filter_by(email='ada@example.com').one()
+        assert session.claim_email(ada, 'test_claim', subject='Hello', dest=ada.email, body='Hi')
+        assert not session.claim_email(ada, 'test_claim', subject='Hello', dest=ada.email, body='Hi')
+
+
+def test_reclaim_failed_and_stale_emails(users):
+    with Session() as session:
+        ada = session.query(User).filter_by(email='ada@example.com').one()
+        claim_id = session.claim_email(ada, 'test_reclaim', subject='Hello', dest=ada.email, body='Hi')
+        session.query(Email).filter_by(id=claim_id).update({Email.status: c.EMAIL_FAILED})
+        assert session.claim_email(ada, 'test_reclaim', subject='Hello', dest=ada.email, body='Hi') == claim_id
+
+        session.query(Email).filter_by(id=claim_id).update({
+            Email.when: datetime.now(UTC) - timedelta(seconds=c.EMAIL_CLAIM_TIMEOUT + 60)})
+        assert session.claim_email(ada, 'test_reclaim', subject='Hello', dest=ada.email, body='Hi') == claim_id
+
+
+def test_manual_emails_keep_their_history(users, monkeypatch):
+    monkeypatch.setattr(c, 'SEND_EMAILS', False)
+    with Session() as session:
+        ada = session.query(User).filter_by(email='ada@example.com').one()
+        session.claim_email(ada, 'Hello', subject='Hello', dest=ada.email, body='Hi')
+        session.commit()
+        for i in range(2):
+            send_email(c.REGDESK_EMAIL, ada.email, 'Hello', 'Hi', model=ada)
+        assert session.query(Email).filter_by(fk_id=ada.id, ident='Hello').count() == 3
+
+
+def test_send_claimed_saves_text_body(users, email_category, monkeypatch):
+    monkeypatch.setattr(c, 'SEND_EMAILS', False)
+    category = email_category('test_text_body')
+    with Session() as session:
+        ada = session.query(User).filter_by(email='ada@example.com').one()
+        assert category.send_claimed(session, ada)
+        email = session.query(Email).filter_by(fk_id=ada.id, ident='test_text_body').one()
+        assert isinstance(email.body, str) and email.body.startswith('Ada')
+        assert email.subject == 'Test email'
@@ -0,0 +1,38 @@
+import pytest
+
+import darecms.config
+from darecms.common import *
+
+
+def test_blank_date_is_removed():
+    c.make_dates({'test_deadline': '2000-01-01'})
+    assert 'TEST_DEADLINE' in c.DATES and c.AFTER_TEST_DEADLINE
+
+    c.make_dates({'test_deadline': ''})
+    assert 'TEST_DEADLINE' not in c.DATES
+    assert c.TEST_DEADLINE is None
+    assert not c.BEFORE_TEST_DEADLINE and not c.AFTER_TEST_DEADLINE
+
+
+def test_reload_resets_removed_dates(monkeypatch):
+    old_config = darecms.config._config
+    monkeypatch.setattr(darecms.config, '_config', dict(old_config, dates=dict(old_config['dates'], test_deadline='2000-01-01')))
+    c.make_dates({'test_deadline': '2000-01-01'})
+
+    reload_config()
+    assert 'TEST_DEADLINE' not in c.DATES
+    assert c.TEST_DEADLINE is None
+    assert not c.AFTER_TEST_DEADLINE
+    assert 'TEST_DEADLINE' not in deadlines.names
+
+
+def test_reload_keeps_config_values():
+    event_name = c.EVENT_NAME
+    reload_config()
+    assert c.EVENT_NAME == event_name
+
+
+def test_unknown_names_are_not_cached():
+    with pytest.raises(AttributeError):
+        c.NOT_A_REAL_SETTING
+    assert 'NOT_A_REAL_SETTING' not in darecms.config._getters
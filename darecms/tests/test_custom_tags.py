@@ -0,0 +1,40 @@
+from darecms.common import *
+from darecms.custom_tags import options, int_options, _OptionsCache
+
+
+def test_options_list_modified_in_place():
+    opts = [(1, 'One'), (2, 'Two')]
+    assert 'Three' not in options(opts)
+
+    opts.append((3, 'Three'))
+    assert '<option value="3" selected="selected">Three</option>' in options(opts, 3)
+
+    opts[0] = (1, 'Uno')
+    rendered = options(opts)
+    assert 'Uno' in rendered and 'One' not in rendered
+
+
+def test_options_escaped_and_selected():
+    rendered = options([('a"b', '<i>')], 'a"b')
+    assert rendered == '<option value="a&quot;b" selected="selected">&lt;i&gt;</option>'
+
+
+def test_unhashable_options_are_not_cached():
+    cache = _OptionsCache()
+    opts = [({'x': 1}, 'X')]
+    assert cache.get(opts).all_unselected == cache.get(opts).all_unselected
+    assert not cache.entries
+
+
+def test_options_cache_is_bounded():
+    cache = _OptionsCache(max_size=2)
+    for i in range(3):
+        cache.get([i])
+    assert list(cache.entries) == [(1,), (2,)]
+
+
+def test_int_options():
+    assert int_options(1, 3, 2).count('selected="selected"') == 1
+    assert '<option value="2" selected="selected">2</option>' in int_options(1, 3, 2)
+    assert 'selected="selected"' not in int_options(1, 3, 5)
+    assert int_options(1, 3, '3').count('<option') == 3
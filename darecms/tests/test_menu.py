@@ -0,0 +1,46 @@
+import pytest
+
+from darecms.common import *
+
+
+@pytest.fixture
+def menu():
+    return MenuItem(name='Root', submenu=[
+        MenuItem(name='Users', access=[c.ACCOUNTS], submenu=[
+            MenuItem(name='All', href='{{ c.PATH }}/accounts/all'),
+        ]),
+        MenuItem(name='Sitemap', href='/accounts/sitemap', access=[c.PEOPLE]),
+        MenuItem(name='Login', href='/accounts/login', priority=100000)
+    ])
+
+
+def names(filtered):
+    return [menu_item['name'] for menu_item in filtered['submenu']]
+
+
+def test_filtered_by_access(menu):
+    assert names(menu.render_items_filtered_by_access(set())) == ['Login']
+    assert names(menu.render_items_filtered_by_access({c.PEOPLE})) == ['Sitemap', 'Login']
+    assert names(menu.render_items_filtered_by_access({c.ACCOUNTS, c.PEOPLE})) == ['Sitemap', 'Users', 'Login']
+
+
+def test_filtered_menu_is_shared_and_read_only(menu):
+    filtered = menu.render_items_filtered_by_access({c.PEOPLE})
+    assert menu.render_items_filtered_by_access([c.PEOPLE]) is filtered
+    with pytest.raises(TypeError):
+        filtered['name'] = 'Changed'
+    with pytest.raises(AttributeError):
+        filtered['submenu'].append({})
+
+
+def test_appending_clears_filtered_menus(menu):
+    filtered = menu.render_items_filtered_by_access({c.PEOPLE})
+    menu.append_menu_item(MenuItem(name='Help', href='/help'))
+    assert names(menu.render_items_filtered_by_access({c.PEOPLE})) == ['Help', 'Sitemap', 'Login']
+    assert menu.render_items_filtered_by_access({c.PEOPLE}) is not filtered
+
+
+def test_snippets_rendered_per_request(menu):
+    rendered = MenuItem._render(menu.render_items_filtered_by_access({c.ACCOUNTS}), {'c': c})
+    [users] = [menu_item for menu_item in rendered['submenu'] if menu_item['name'] == 'Users']
+    assert users['submenu'][0]['href'] == c.PATH + '/accounts/all'
@@ -0,0 +1,23 @@
+from darecms.common import *
+
+
+def outgoing_email(subject='Hello'):
+    return OutgoingEmail(c.REGDESK_EMAIL, ['ada@example.com'], [], [], subject, 'Hi')
+
+
+def test_sends_immediately_when_server_is_not_running(tmpdir):
+    outbox = Outbox(lambda: FileTransport(str(tmpdir)))
+    outbox.put(outgoing_email())
+    assert len(tmpdir.listdir()) == 1
+    assert outbox.queue.qsize() == 0 and not outbox.workers
+
+
+def test_drain_sends_queued_emails(tmpdir):
+    outbox = Outbox(lambda: FileTransport(str(tmpdir)))
+    for i in range(3):
+        outbox.queue.put(outgoing_email('Hello #{}'.format(i)))
+
+    outbox.drain()
+    assert len(tmpdir.listdir()) == 3
+    assert outbox.queue.qsize() == 0 and outbox.queue.unfinished_tasks == 0
+    assert outbox.sent == 3
@@ -0,0 +1,26 @@
+import pytest
+
+from darecms.common import *
+from darecms.server import StaticViews, static_view_url
+
+
+@pytest.mark.parametrize('accept_encoding,expected', [
+    ('', False),
+    ('deflate', False),
+    ('gzip, deflate', True),
+    ('br, gzip;q=0.1', True),
+    ('GZIP;Q=0.5', True),
+    ('gzip;q=0', False),
+    ('gzip;q=0, *', False),
+    ('*', True),
+    ('identity;q=1, *;q=0', False),
+])
+def test_accepts_gzip(accept_encoding, expected):
+    assert StaticViews.accepts_gzip(accept_encoding) == expected
+
+
+
+def test_static_view_url_is_fingerprinted():
+    rendered = StaticViews.get_rendered('static_views/js/config.js')
+    assert static_view_url('js/config.js') == '{}/static_views/js/config.js?v={}'.format(c.PATH, rendered['fingerprint'])
+    assert rendered['content_type'] in ['application/javascript', 'text/javascript']
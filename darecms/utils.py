@@ -146,32 +146,35 @@ def hour_day_format(dt):
     return dt.astimezone(c.EVENT_TIMEZONE).strftime('%I%p ').strip('0').lower() + dt.astimezone(c.EVENT_TIMEZONE).strftime('%a')
 
 
-def send_email(source, dest, subject, body, format='text', cc=(), bcc=(), model=None, ident=None):
-    subject = subject.format(c=c)
+def send_email(source, dest, subject, body, format='text', cc=(), bcc=(), model=None, ident=None, claimed=None):
+    """
+    Queues an email to be sent by our outbox.  If model is passed, we save an
+    Email row once the email has been sent, unless the caller has already
+    claimed one with Session.claim_email() and passes its id as claimed, in
+    which case that row is marked as sent (or failed) instead.  Claimed emails
+    were saved with their subject already formatted, so we send it as-is.
+    """
+    subject = subject if claimed else subject.format(c=c)
     to, cc, bcc = map(listify, [dest, cc, bcc])
     ident = ident or subject
     if c.DEV_BOX:
         for xs in [to, cc, bcc]:
             xs[:] = [email for email in xs if email.endswith('mailinator.com') or c.DEVELOPER_EMAIL in email]
 
+    body = body.decode('utf-8') if isinstance(body, bytes) else body
+    record = None
+    if model and dest and not claimed:
+        fk = {'model': 'n/a'} if model == 'n/a' else {'fk_id': model.id, 'model': model.__class__.__name__}
+        record = sa.Email(subject=subject, dest=','.join(listify(dest)), body=body, ident=ident, **fk)
+
     if c.SEND_EMAILS and to:
-         message = EmailMessage(subject=subject, **{'bodyText' if format == 'text' else 'bodyHtml': body})
-         AmazonSES(c.AWS_ACCESS_KEY, c.AWS_SECRET_KEY).sendEmail(
-             source=source,
-             toAddresses=to,
-             ccAddresses=cc,
-             bccAddresses=bcc,
-             message=message
-         )
-         sleep(0.1)  # avoid hitting rate limit
-         pass
+        sa.outbox.put(sa.OutgoingEmail(source, to, cc, bcc, subject, body, format, record=record, claim_id=claimed))
     else:
         log.error('email sending turned off, so unable to send {}', locals())
-
-    if model and dest:
-        body = body.decode('utf-8') if isinstance(body, bytes) else body
-        fk = {'model': 'n/a'} if model == 'n/a' else {'fk_id': model.id, 'model': model.__class__.__name__}
-        _record_email_sent(sa.Email(subject=subject, dest=','.join(listify(dest)), body=body, ident=ident, **fk))
+        if claimed:
+            sa.outbox.record_status(claimed, c.EMAIL_SENT)
+        elif record is not None:
+            _record_email_sent(record)
 
 
 def _record_email_sent(email):
@@ -228,15 +231,7 @@ def static_overrides(dirname):
     are the theme image files, but theoretically a plugin can override anything
     it wants by calling this method and passing its static directory.
     """
-    appconf = cherrypy.tree.apps[c.PATH].config
-    basedir = os.path.abspath(dirname).rstrip('/')
-    for dpath, dirs, files in os.walk(basedir):
-        relpath = dpath[len(basedir):]
-        for fname in files:
-            appconf['/static' + relpath + '/' + fname] = {
-                'tools.staticfile.on': True,
-                'tools.staticfile.filename': os.path.join(dpath, fname)
-            }
+    sa.asset_manifest.add_static_dir(dirname)
 
 
 def mount_site_sections(module_root):
@@ -273,10 +268,21 @@ _when_dateformat = "%m/%d"
 
 
 class DateBase:
+    """
+    Base class for our date-gated helpers below.  Each helper registers its
+    dates with our DeadlineTimeline when it's created, so calling it is just a
+    lookup of flags which are flipped when each date passes.  To change the
+    time in unit tests, use deadlines.set_now() rather than patching now().
+    """
     @staticmethod
     def now():
-        # This exists so we can patch this in unit tests
-        return localized_now()
+        return deadlines.now().astimezone(c.EVENT_TIMEZONE)
+
+    @staticmethod
+    def _watch(*dts):
+        for dt in dts:
+            if dt:
+                deadlines.watch(dt)
 
 
 class days_before(DateBase):
@@ -305,12 +311,13 @@ class days_before(DateBase):
             self.ending_date = deadline if not until else (deadline - timedelta(days=until))
 
             assert self.starting_date < self.ending_date
+            self._watch(self.starting_date, self.ending_date)
 
     def __call__(self):
         if not self.deadline:
             return False
 
-        return self.starting_date < self.now() < self.ending_date
+        return deadlines.has_passed(self.starting_date) and not deadlines.has_passed(self.ending_date)
 
     @property
     def active_when(self):
@@ -334,9 +341,10 @@ class before(DateBase):
     """
     def __init__(self, deadline):
         self.deadline = deadline
+        self._watch(deadline)
 
     def __call__(self):
-        return bool(self.deadline) and self.now() < self.deadline
+        return bool(self.deadline) and not deadlines.has_passed(self.deadline)
 
     @property
     def active_when(self):
@@ -361,9 +369,10 @@ class days_after(DateBase):
             raise ValueError("'days' paramater must be >= 0. days={}".format(days))
 
         self.starting_date = None if not deadline else deadline + timedelta(days=days)
+        self._watch(self.starting_date)
 
     def __call__(self):
-        return bool(self.starting_date) and (self.now() > self.starting_date)
+        return bool(self.starting_date) and deadlines.has_passed(self.starting_date)
 
     @property
     def active_when(self):
@@ -0,0 +1,202 @@
+from darecms.common import *
+
+
+def soundex(name):
+    """
+    Returns the American Soundex code for a name, e.g. "Robert" and "Rupert"
+    both become "R163".  We use this as one of our watchlist blocking keys so
+    that misspelled last names still end up being compared.
+    """
+    name = re.sub('[^a-z]', '', (name or '').lower())
+    if not name:
+        return ''
+
+    code, last = name[0].upper(), _SOUNDEX_CODES[name[0]]
+    for letter in name[1:]:
+        digit = _SOUNDEX_CODES[letter]
+        if digit != '0' and digit != last:
+            code += digit
+        if letter not in 'hw':
+            last = digit
+    return (code + '000')[:4]
+
+_SOUNDEX_CODES = {letter: str(digit)
+                  for digit, letters in enumerate(['aeiouyhw', 'bfpv', 'cgjkqsxz', 'dt', 'l', 'mn', 'r'])
+                  for letter in letters}
+
+
+def _normalize_name(name):
+    return re.sub('[^a-z]', '', (name or '').lower())
+
+
+class WatchListIndex:
+    """
+    In-memory screening index over all active WatchList entries.
+
+    Comparing every user against every watchlist entry is quadratic, so instead
+    we file each entry under a few "blocking keys" (normalized last name, the
+    Soundex code of the last name, and birthdate) and only fuzzy-score a user
+    against the entries which share at least one key with them.
+
+    The index is built when the server starts, since our presave adjustments
+    screen users against it in the middle of a flush where we can't open
+    another session, and is then kept up to date from our session events; see
+    _record_watchlist_changes() below.  Entries are stored as plain dicts so
+    they can be handed to templates without a session.
+    """
+
+    def __init__(self):
+        self.lock = RLock()
+        self.loaded = False
+        self.entries = {}
+        self.blocks = defaultdict(set)
+
+    @staticmethod
+    def blocking_keys(last_name, birthdate=None):
+        keys = set()
+        if _normalize_name(last_name):
+            keys.add(('last_name', _normalize_name(last_name)))
+            keys.add(('soundex', soundex(last_name)))
+        if birthdate:
+            keys.add(('birthdate', birthdate))
+        return keys
+
+    @staticmethod
+    def snapshot(entry):
+        return {name: getattr(entry, name) for name in entry.__table__.columns.keys()}
+
+    def refresh(self):
+        """Rebuild the whole index from the database."""
+        with Session() as session:
+            entries = [self.snapshot(entry) for entry in session.cached(session.query(WatchList).filter_by(active=True))]
+
+        with self.lock:
+            self.entries, self.blocks = {}, defaultdict(set)
+            for entry in entries:
+                self._add(entry)
+            self.loaded = True
+
+    def _add(self, entry):
+        self.entries[entry['id']] = entry
+        for key in self.blocking_keys(entry['last_name'], entry['birthdate']):
+            self.blocks[key].add(entry['id'])
+
+    def remove(self, entry_id):
+        with self.lock:
+            entry = self.entries.pop(entry_id, None)
+            if entry:
+                for key in self.blocking_keys(entry['last_name'], entry['birthdate']):
+                    self.blocks[key].discard(entry_id)
+                    if not self.blocks[key]:
+                        del self.blocks[key]
+
+    def update(self, entry):
+        """Add, replace, or (for inactive entries) remove a snapshot of a WatchList entry."""
+        with self.lock:
+            self.remove(entry['id'])
+            if entry['active']:
+                self._add(entry)
+
+    def lookup(self, ids):
+        """Returns the active entries with the given ids, e.g. from User.watchlist_guesses."""
+        with self.lock:
+            return [self.entries[id] for id in ids if id in self.entries]
+
+    def candidates(self, last_name, birthdate=None):
+        with self.lock:
+            ids = set()
+            for key in self.blocking_keys(last_name, birthdate):
+                ids.update(self.blocks.get(key, ()))
+            return [self.entries[id] for id in ids]
+
+    def score(self, entry, first_name, last_name, email='', birthdate=None):
+        """
+        Returns how closely (0-100) someone matches a watchlist entry.  As with
+        our old database query, the last name has to match, plus at least one
+        of first name, email, or birthdate.  We match names fuzzily to catch
+        misspellings and nicknames listed among the entry's first_names.
+        """
+        threshold = c.WATCHLIST_MATCH_THRESHOLD
+        last_score = fuzz.ratio(_normalize_name(last_name), _normalize_name(entry['last_name']))
+        if last_score < threshold and soundex(last_name) != soundex(entry['last_name']):
+            return 0
+
+        first_names = [_normalize_name(name) for name in re.split('[,;/]', entry['first_names'] or '')]
+        first_score = max([fuzz.ratio(_normalize_name(first_name), name) for name in first_names if name] or [0])
+        if first_score >= threshold:
+            return (last_score + first_score) // 2
+        elif email and entry['email'] and email.strip().lower() == entry['email'].strip().lower():
+            return last_score
+        elif birthdate and birthdate == entry['birthdate']:
+            return last_score
+        else:
+            return 0
+
+    def screen(self, first_name, last_name, email='', birthdate=None):
+        """Returns the watchlist entries which match this person, best match first."""
+        scored = [(self.score(entry, first_name, last_name, email, birthdate), entry)
+                  for entry in self.candidates(last_name, birthdate)]
+        return [entry for score, entry in sorted(scored, key=lambda pair: -pair[0]) if score]
+
+    def screen_user(self, user):
+        return self.screen(user.first_name, user.last_name, user.email, user.birthdate)
+
+watchlist_index = WatchListIndex()
+on_startup(watchlist_index.refresh, priority=2)
+
+
+def screen_all_users(batch_size=1000):
+    """
+    Re-screens every user against the current watchlist and saves the ids of
+    any matching entries to User.watchlist_guesses.  This writes directly with
+    bulk updates, so it skips our presave adjustments and change tracking.
+
+    Returns the number of users whose guesses changed.
+    """
+    watchlist_index.refresh()
+    changed = 0
+    with Session() as session:
+        rows = (session.query(User.id, User.first_name, User.last_name, User.email, User.birthdate, User.watchlist_guesses)
+                       .yield_per(batch_size))
+        updates = []
+        for id, first_name, last_name, email, birthdate, old_guesses in rows:
+            guesses = ','.join(entry['id'] for entry in watchlist_index.screen(first_name, last_name, email, birthdate))
+            if guesses != old_guesses:
+                updates.append({'id': id, 'watchlist_guesses': guesses})
+
+        for i in range(0, len(updates), batch_size):
+            session.bulk_update_mappings(User, updates[i:i + batch_size])
+        changed = len(updates)
+
+    log.info('watchlist screening updated guesses for {} users', changed)
+    return changed
+
+
+@swallow_exceptions
+def _record_watchlist_changes(session, context):
+    changes = session.info.setdefault('watchlist_changes', {})
+    for instance in chain(session.new, session.dirty):
+        if isinstance(instance, WatchList):
+            changes[instance.id] = WatchListIndex.snapshot(instance)
+    for instance in session.deleted:
+        if isinstance(instance, WatchList):
+            changes[instance.id] = None
+
+
+@swallow_exceptions
+def _apply_watchlist_changes(session):
+    changes = session.info.pop('watchlist_changes', {})
+    if watchlist_index.loaded:
+        for id, entry in changes.items():
+            if entry is None:
+                watchlist_index.remove(id)
+            else:
+                watchlist_index.update(entry)
+
+
+def _discard_watchlist_changes(session):
+    session.info.pop('watchlist_changes', None)
+
+listen(Session.session_factory, 'after_flush', _record_watchlist_changes)
+listen(Session.session_factory, 'after_commit', _apply_watchlist_changes)
+listen(Session.session_factory, 'after_rollback', _discard_watchlist_changes)